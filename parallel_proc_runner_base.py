@@ -24,21 +24,44 @@ import threading
 import sys
 import os
 import re
+import shutil
+import socket
+import signal
 import uuid
+import math
+import gzip
+import json
+import zlib
 import optparse
-import webbrowser
+import heapq
+import http.server
+import mmap
 import tkinter as tk
 import tkinter.ttk as ttk
-from tempfile import gettempdir
-from enum import Enum
-from time import sleep
+import tkinter.font as tkfont
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from tempfile import gettempdir, mkstemp
+from enum import Enum, IntEnum
+from time import sleep, time, strftime
 from random import randint
 
 
+class JobStatus(IntEnum):
+    NOT_RUN, PASSED, FAILED, EXCEPTION = range(0, 4)
+
+
+class Severity(IntEnum):
+    WARNING, ERROR, FATAL = range(0, 3)
+
+
 class BaseJobRunner:
     """This base class that allows easy implementation of an application that can run parallel processes
     with a choice between a GUI or command-line interface"""
 
+    PROGRESS_CALLBACK_INTERVAL = 0.5
+
     def __init__(self, name):
         self.name = name
 
@@ -50,6 +73,7 @@ class BaseJobRunner:
         self.start_gating_event = None
         self.start_callback = self.dummy_method
         self.stop_callback = self.dummy_method
+        self.progress_callback = self.dummy_method
         self.stop_event = threading.Event()
 
         # For polling instead of using callbacks
@@ -57,9 +81,52 @@ class BaseJobRunner:
         self.result = -1
         self.output = ""
         self.result_message = ""
+        self.status = JobStatus.NOT_RUN
+        self.start_time = None
+        self.stop_time = None
+
+        # Latest progress reported by job() through report_progress()
+        self.progress_lock = threading.Lock()
+        self.progress_fraction = None
+        self.progress_message = ""
+        self.last_progress_callback_time = 0.0
+        self.progress_pending = False  # A report that the rate limit held back, delivered by progress_timer
+        self.progress_timer = None
 
         self.setup_kwargs = dict()
 
+        # Metadata that the GUI selection filter can match with "tag:NAME" and "attr:KEY=VALUE"
+        self.tags = set()
+        self.attributes = dict()
+
+        # Lightweight runners (very short jobs) may be run in batches by a BatchDispatcher
+        self.lightweight = False
+
+        # Used by a PriorityScheduler: higher priority runners start first, each on a numbered worker slot
+        self.priority = 0
+        self.worker_slot = None
+
+        # Used by a PriorityScheduler with a CpuPlacement: the CPUs this runner asks for, and those it is bound to
+        self.num_cpus = 1
+        self.cpu_set = None
+
+        # Optional ScratchManager that provides job() with a scratch directory in setup_kwargs['scratch_dir']
+        self.scratch_manager = None
+        self.scratch_dir = None
+
+        # Optional OutputClassifier that scans the output for errors as it is emitted
+        self.output_classifier = None
+        self.output_scan = None
+        self.classification = ""
+        self.terminated_by_classifier = False
+
+        # RunObservers that are notified as this runner is queued, starts and finishes
+        self.observers = list()
+        self.queued_time = None
+        self.gate_wait_start_time = None
+        self.gate_opened_time = None
+        self.stop_callback_done_time = None
+
     def dummy_method(self, *args, **kwargs):
         pass
 
@@ -72,46 +139,154 @@ class BaseJobRunner:
     def set_stop_callback(self, stop_callback):
         self.stop_callback = stop_callback
 
+    def set_progress_callback(self, progress_callback):
+        """For tools that embed BaseJobRunner: called with (name, fraction, message) as job() reports progress. The GUI
+        and the CLI don't use it, they poll get_progress() instead."""
+        self.progress_callback = progress_callback
+
+    def has_progress_callback(self):
+        return self.progress_callback is not None and self.progress_callback != self.dummy_method
+
     def set_args(self, **kwargs):
         self.setup_kwargs = kwargs
 
+    def set_tags(self, *tags):
+        self.tags = set(tags)
+
+    def set_attributes(self, **attributes):
+        self.attributes = attributes
+
+    def set_lightweight(self, lightweight=True):
+        self.lightweight = lightweight
+
+    def set_priority(self, priority):
+        self.priority = priority
+
+    def set_num_cpus(self, num_cpus):
+        self.num_cpus = num_cpus
+
+    def set_scratch_manager(self, scratch_manager):
+        self.scratch_manager = scratch_manager
+
+    def set_output_classifier(self, output_classifier):
+        self.output_classifier = output_classifier
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
+
+    def release_output(self):
+        """Drop the output text once it has been saved elsewhere (e.g. to a file referenced by a JobResult), so that
+        finished runners don't keep the whole log in memory."""
+        self.output = ""
+
     def start(self):
+        self.prepare_to_start()
+        self.start_thread()
+
+    def restore(self, job_result):
+        """Marks the runner as finished with the JobResult of an earlier run (e.g. from a RunJournal) without running
+        it, so that the runners gated on its stop_event can start. The observers are not notified, as it never ran."""
+        self.reset_state()
+        self.status = job_result.status
+        self.result = job_result.return_code
+        self.classification = job_result.classification
+        self.result_message = job_result.get_result_message()
+        self.start_time = job_result.start_time
+        self.stop_time = job_result.stop_time
+        self.stop_event.set()
+
+    def start_thread(self):
+        """Run run() in a new thread, without resetting the state first (see prepare_to_start())"""
+        self.thread = threading.Thread(name=self.name, target=self.run)
+        self.thread.start()
+
+    def prepare_to_start(self):
+        """Reset the state of a previous run. start() does this before running run() in a new thread. Something that
+        calls run() itself (such as a BatchDispatcher) must call this first."""
+        self.reset_state()
+        self.queued_time = time()
+        for observer in self.observers:
+            observer.runner_queued(self)
+
+    def reset_state(self):
         self.result = -1
         self.output = ""
         self.result_message = ""
+        self.status = JobStatus.NOT_RUN
+        self.start_time = None
+        self.stop_time = None
+        self.output_scan = None
+        self.classification = ""
+        self.terminated_by_classifier = False
+        with self.progress_lock:
+            self.progress_fraction = None
+            self.progress_message = ""
+            self.last_progress_callback_time = 0.0
+            self.progress_pending = False
+            if self.progress_timer is not None:
+                self.progress_timer.cancel()
+                self.progress_timer = None
+        self.gate_wait_start_time = None
+        self.gate_opened_time = None
+        self.stop_callback_done_time = None
         if self.stop_event.is_set():
             self.stop_event.clear()
-        self.thread = threading.Thread(name=self.name, target=self.run)
-        self.thread.start()
 
     def run(self):
         """When start() is called, this run() method will be called in a new thread"""
 
         self.running = False
 
+        self.gate_wait_start_time = time()
         if self.start_gating_event is not None:
             self.start_gating_event.wait()
+        self.gate_opened_time = time()
 
         self.running = True
+        for observer in self.observers:
+            observer.runner_started(self)
         if self.start_callback is not None:
             self.start_callback(self.name)
 
+        self.start_time = time()
         try:
+            if self.output_classifier is not None:
+                self.output_scan = self.output_classifier.new_scan()
+            if self.cpu_set is not None and hasattr(os, 'sched_setaffinity'):
+                # Binds this thread only (pid 0 is the calling thread), and the processes job() starts inherit it
+                os.sched_setaffinity(0, self.cpu_set)
+            if self.scratch_manager is not None:
+                self.scratch_dir = self.scratch_manager.acquire(self.name)
+                self.setup_kwargs['scratch_dir'] = self.scratch_dir
             self.result, self.output = self.job()
-            self.result_message = "Success" if self.result == 0 else "FAIL (" + str(self.result) + ")"
+            self.classify_output()
+            self.status = JobStatus.PASSED if self.result == 0 else JobStatus.FAILED
+            self.result_message = JobResult.format_result_message(self.status, self.result, self.classification)
 
         except Exception as e:
             # Catch all exceptions in the child thread. This isn't generally a good idea, but we want exceptions to be
             # reported to the parent thread.
-            self.result_message = "FAIL (Exception)"
+            self.status = JobStatus.EXCEPTION
+            self.result_message = JobResult.format_result_message(self.status, self.result, self.classification)
 
             self.output += "\n" + type(e).__name__ + ": " + str(e)
 
         finally:
+            self.stop_time = time()
+            if self.scratch_dir is not None:
+                self.scratch_manager.release(self.scratch_dir, self.status == JobStatus.PASSED)
+                self.scratch_dir = None
             self.running = False
+            self.flush_progress()
             if self.stop_callback is not None:
                 self.stop_callback(self.name, self.result_message, self.output)
-            self.stop_event.set()
+            self.stop_callback_done_time = time()
+            for observer in self.observers:
+                observer.runner_finished(self)
+            self.stop_event.set()  # Last, so that whoever waits on it knows the observers have seen the runner finish
 
     def job(self):
         """Child type should implement job() to do the task this runner is trying to accomplish.
@@ -121,41 +296,1629 @@ class BaseJobRunner:
         output = "Override this method"
         return result, output
 
+    def emit_output(self, chunk):
+        """job() may call this, from any thread, with each chunk of output as it arrives, so that the output classifier
+        can react to it (e.g. terminate() the job on a fatal error) before job() returns. The output returned by job()
+        is then not scanned again."""
+        if self.output_scan is None:
+            return
+        if self.output_scan.feed(chunk) and self.output_classifier.terminate_on_fatal \
+                and not self.terminated_by_classifier:
+            self.terminated_by_classifier = True
+            self.terminate()
+
+    def classify_output(self):
+        """Called after job() returns. A classifier match overrides a passing result."""
+        if self.output_scan is None:
+            return
+        if not self.output_scan.fed:
+            self.output_scan.feed(self.output)
+        self.output_scan.finish()
+        self.classification = self.output_scan.get_summary()
+        if self.result == 0 and self.output_scan.is_failure():
+            self.result = OutputScan.FAIL_RESULT
+
+    def report_progress(self, fraction, message=""):
+        """job() may call this, from any thread, to report how far along it is (fraction is from 0.0 to 1.0).
+        Only the latest report is kept, and the progress callback is called at most once every
+        PROGRESS_CALLBACK_INTERVAL seconds, so a job that reports very often can't flood the GUI or CLI. A report held
+        back by that limit is not lost: the latest one is delivered at the end of the interval, or when the job
+        finishes (before the stop callback). Without a progress callback, the report is only kept for get_progress()."""
+        fraction = max(0.0, min(1.0, float(fraction)))
+        now = time()
+        with self.progress_lock:
+            self.progress_fraction = fraction
+            self.progress_message = message
+            if not self.has_progress_callback():
+                return
+            elapsed = now - self.last_progress_callback_time
+            call_back = elapsed >= BaseJobRunner.PROGRESS_CALLBACK_INTERVAL
+            if call_back:
+                self.last_progress_callback_time = now
+                self.progress_pending = False
+            else:
+                self.progress_pending = True
+                if self.progress_timer is None:
+                    self.progress_timer = threading.Timer(BaseJobRunner.PROGRESS_CALLBACK_INTERVAL - elapsed,
+                                                          self.deliver_pending_progress)
+                    self.progress_timer.daemon = True
+                    self.progress_timer.start()
+        if call_back:
+            self.progress_callback(self.name, fraction, message)
+
+    def deliver_pending_progress(self):
+        with self.progress_lock:
+            self.progress_timer = None
+            if not self.progress_pending:
+                return
+            self.progress_pending = False
+            self.last_progress_callback_time = time()
+            fraction = self.progress_fraction
+            message = self.progress_message
+        if self.has_progress_callback():
+            self.progress_callback(self.name, fraction, message)
+
+    def flush_progress(self):
+        """Delivers a progress report held back by the rate limit now"""
+        with self.progress_lock:
+            timer = self.progress_timer
+        if timer is not None:
+            timer.cancel()
+        self.deliver_pending_progress()
+
+    def get_progress(self):
+        """Returns (fraction, message) of the latest progress report. fraction is None if none was reported."""
+        with self.progress_lock:
+            return self.progress_fraction, self.progress_message
+
     def terminate(self):
         """Child type may choose to implement this to kill the run()/job() thread."""
         print("terminate() not implemented for", self.name)
 
+    def get_live_output_file_name(self):
+        """Child type may implement this to return the name of a file that job() writes its output to while it runs,
+        so that the GUI can follow the output of a running job."""
+        return None
+
+
+class OutputClassifier:
+    """A set of regex patterns, each with a Severity, searched for in a job's output as it is emitted. The patterns are
+    combined into one regex, so each chunk of output is scanned once no matter how many patterns there are. A match of
+    an ERROR or FATAL pattern fails the job, and a FATAL match can terminate() it right away. As they are combined,
+    patterns may not set global inline flags such as "(?i)" (use a scoped "(?i:...)" instead) or use backreferences."""
+
+    BACKREFERENCE = re.compile(r"(?<!\\)(?:\\\\)*\\(?:[1-9]|g<)|\(\?P=")
+
+    def __init__(self, terminate_on_fatal=False):
+        self.terminate_on_fatal = terminate_on_fatal
+        self.patterns = list()
+        self.combined_pattern = None
+
+    def add_pattern(self, severity, regex):
+        """Raises re.error now, rather than when a job starts, if the pattern is invalid or can't be combined"""
+        if re.compile(regex).flags & ~re.UNICODE:
+            raise re.error("global inline flags can't be used in an output pattern, use e.g. (?i:...): " + regex)
+        if OutputClassifier.BACKREFERENCE.search(regex):
+            raise re.error("backreferences can't be used in an output pattern: " + regex)
+        self.patterns.append((severity, regex))
+        self.combined_pattern = None
+        try:
+            self.get_combined_pattern()
+        except re.error:
+            self.patterns.pop()
+            self.combined_pattern = None
+            raise
+
+    def is_empty(self):
+        return len(self.patterns) == 0
+
+    def get_combined_pattern(self):
+        if self.combined_pattern is None:
+            self.combined_pattern = re.compile("|".join("(?P<p" + str(i) + ">" + regex + ")"
+                                                        for i, (severity, regex) in enumerate(self.patterns)))
+        return self.combined_pattern
+
+    def get_severity(self, group_name):
+        return self.patterns[int(group_name[1:])][0]
+
+    def new_scan(self):
+        return OutputScan(self)
+
+
+class OutputScan:
+    """The state of classifying the output of one run of a job. Output is fed in chunks and scanned a line at a time,
+    so matches aren't missed when a line is split across chunks."""
+
+    FAIL_RESULT = 1  # Replaces a passing result when an ERROR or FATAL pattern matched
+    MAX_PARTIAL_LINE = 1 << 16
+    MAX_REPORTED_LINES = 3
+    MAX_REPORTED_LINE_LENGTH = 80
+
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self.pattern = classifier.get_combined_pattern()
+        self.lock = threading.Lock()
+        self.fed = False
+        self.partial_line = ""
+        self.counts = {severity: 0 for severity in Severity}
+        self.matching_lines = list()
+
+    def feed(self, chunk):
+        """Returns True if a FATAL pattern matched in this chunk"""
+        with self.lock:
+            self.fed = True
+            text = self.partial_line + chunk
+            end = text.rfind("\n") + 1
+            if end == 0 and len(text) > OutputScan.MAX_PARTIAL_LINE:
+                end = len(text)  # Don't buffer an endless line
+            self.partial_line = text[end:]
+            return self.scan(text, end)
+
+    def finish(self):
+        with self.lock:
+            text = self.partial_line
+            self.partial_line = ""
+            self.scan(text, len(text))
+
+    def scan(self, text, end):
+        """Call with the lock held. Counts each matching line once, at the highest severity matched on it."""
+        line_severities = OrderedDict()
+        for match in self.pattern.finditer(text, 0, end):
+            line_start = text.rfind("\n", 0, match.start()) + 1
+            severity = self.classifier.get_severity(match.lastgroup)
+            line_severities[line_start] = max(severity, line_severities.get(line_start, severity))
+        for line_start, severity in line_severities.items():
+            self.counts[severity] += 1
+            if len(self.matching_lines) < OutputScan.MAX_REPORTED_LINES:
+                line_end = text.find("\n", line_start, end)
+                line = text[line_start:end if line_end < 0 else line_end].strip()
+                self.matching_lines.append(line[:OutputScan.MAX_REPORTED_LINE_LENGTH])
+        return Severity.FATAL in line_severities.values()
+
+    def is_failure(self):
+        return self.counts[Severity.FATAL] > 0 or self.counts[Severity.ERROR] > 0
+
+    def get_summary(self):
+        """E.g. "1 fatal, 2 errors, 0 warnings: 'UVM_FATAL ...'". Empty if nothing matched."""
+        if sum(self.counts.values()) == 0:
+            return ""
+        summary = str(self.counts[Severity.FATAL]) + " fatal, " + str(self.counts[Severity.ERROR]) + " errors, " + \
+            str(self.counts[Severity.WARNING]) + " warnings"
+        if len(self.matching_lines) > 0:
+            summary += ": " + ", ".join(repr(line) for line in self.matching_lines)
+        return summary
+
+
+class RunObserver:
+    """Base class for objects that want to be notified, through BaseJobRunner.add_observer(), as runners are queued
+    (start() is called), start running (their start_gating_event has opened) and finish (just before the stop_event is
+    set). These are called from the runners' threads."""
+
+    def runner_queued(self, runner):
+        pass
+
+    def runner_started(self, runner):
+        pass
+
+    def runner_finished(self, runner):
+        pass
+
+
+class RunGroup(RunObserver):
+    """A set of runners that can be waited on together, for tools that embed BaseJobRunner:
+
+        group = RunGroup(runners)
+        group.start()
+        for runner in group.as_completed():
+            print(runner.name, runner.result_message)
+
+    Completion is tracked with a completion list that the runners append to as they finish, guarded by one lock,
+    rather than by waiting on each runner's stop_event in turn. Waiters for any completion and waiters for all of them
+    wait on separate conditions of that lock, so that wait_all() isn't woken up by every runner that finishes."""
+
+    def __init__(self, runners=None):
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.all_done_condition = threading.Condition(self.lock)
+        self.runners = list()
+        self.completed = list()  # In the order the runners finished
+        self.completed_ids = set()
+        self.finish_log = list()  # Every finish, including those of runners that were run again since
+        for r in runners if runners is not None else list():
+            self.add(r)
+
+    def add(self, runner):
+        with self.condition:
+            self.runners.append(runner)
+        runner.add_observer(self)
+
+    def close(self):
+        """Stop observing the runners"""
+        for r in self.runners:
+            r.remove_observer(self)
+
+    def start(self):
+        for r in self.runners:
+            r.start()
+
+    def runner_queued(self, runner):
+        with self.condition:
+            if id(runner) in self.completed_ids:  # Running again
+                self.completed_ids.discard(id(runner))
+                self.completed.remove(runner)
+
+    def runner_finished(self, runner):
+        with self.condition:
+            self.completed_ids.add(id(runner))
+            self.completed.append(runner)
+            self.finish_log.append(runner)
+            self.condition.notify_all()
+            if len(self.completed) >= len(self.runners):
+                self.all_done_condition.notify_all()
+
+    def get_finished(self):
+        with self.condition:
+            return list(self.completed)
+
+    def get_pending(self):
+        with self.condition:
+            return [r for r in self.runners if id(r) not in self.completed_ids]
+
+    def as_completed(self, timeout=None):
+        """Yields each runner once as it finishes (those already finished first), even if runners are run again
+        meanwhile. Raises TimeoutError if they haven't all finished within timeout seconds."""
+        deadline = None if timeout is None else time() + timeout
+        position = 0  # In the finish log, which only grows, unlike the completion list
+        yielded_ids = set()
+        while len(yielded_ids) < len(self.runners):
+            with self.condition:
+                while position >= len(self.finish_log):
+                    remaining = None if deadline is None else deadline - time()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(str(len(self.runners) - len(yielded_ids)) + " runner(s) not finished")
+                    self.condition.wait(remaining)
+                runner = self.finish_log[position]
+            position += 1
+            if id(runner) not in yielded_ids:
+                yielded_ids.add(id(runner))
+                yield runner
+
+    def wait_any(self, timeout=None):
+        """Waits until at least one runner has finished, or timeout seconds. Returns (finished, pending) lists."""
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.completed) > 0 or len(self.runners) == 0, timeout)
+        return self.get_finished(), self.get_pending()
+
+    def wait_all(self, timeout=None):
+        """Waits until all runners have finished, or timeout seconds. Returns True if they all finished."""
+        with self.condition:
+            return self.all_done_condition.wait_for(lambda: len(self.completed) >= len(self.runners), timeout)
+
+
+class JobResult:
+    """Compact record of one finished job. The output text is not kept here, only a reference to the file holding it,
+    so that memory scales with the number of jobs rather than with the amount of log text."""
+
+    __slots__ = ('name', 'status', 'return_code', 'start_time', 'stop_time', 'output_file', 'classification')
+
+    def __init__(self, name, status, return_code, start_time=None, stop_time=None, output_file=None,
+                 classification=""):
+        self.name = name
+        self.status = status
+        self.return_code = return_code
+        self.start_time = start_time
+        self.stop_time = stop_time
+        self.output_file = output_file
+        self.classification = classification  # Short summary from the OutputClassifier, if any
+
+    @staticmethod
+    def from_runner(runner, output_file=None):
+        return JobResult(runner.name, runner.status, runner.result, runner.start_time, runner.stop_time, output_file,
+                         runner.classification)
+
+    @staticmethod
+    def format_result_message(status, return_code, classification=""):
+        if status == JobStatus.PASSED:
+            message = "Success"
+        elif status == JobStatus.FAILED:
+            message = "FAIL (" + str(return_code) + ")"
+        elif status == JobStatus.EXCEPTION:
+            message = "FAIL (Exception)"
+        else:
+            message = "Not Run"
+        if classification != "":
+            message += " [" + classification + "]"
+        return message
+
+    def get_result_message(self):
+        return JobResult.format_result_message(self.status, self.return_code, self.classification)
+
+    def passed(self):
+        return self.status == JobStatus.PASSED
+
+    def get_duration(self):
+        if self.start_time is None or self.stop_time is None:
+            return 0.0
+        return self.stop_time - self.start_time
+
+    def read_output(self):
+        if isinstance(self.output_file, ArchivedOutput):
+            return self.output_file.read()
+        if self.output_file is None or not os.path.isfile(self.output_file):
+            return ""
+        with open(self.output_file, 'r') as output_file:
+            return output_file.read()
+
+
+class ResultStore:
+    """Thread-safe collection of the JobResult of every finished job, with some queries over them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = list()
+        self.results_by_name = dict()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.results)
+
+    def __iter__(self):
+        return iter(self.get_all())
+
+    def add(self, job_result):
+        with self.lock:
+            self.results.append(job_result)
+            self.results_by_name[job_result.name] = job_result
+
+    def record_runner(self, runner, output_file=None):
+        job_result = JobResult.from_runner(runner, output_file)
+        self.add(job_result)
+        return job_result
+
+    def clear(self):
+        with self.lock:
+            self.results = list()
+            self.results_by_name = dict()
+
+    def get(self, name):
+        with self.lock:
+            return self.results_by_name.get(name)
+
+    def get_all(self):
+        """Results in the order the jobs finished"""
+        with self.lock:
+            return list(self.results)
+
+    def failing(self):
+        return [r for r in self.get_all() if not r.passed()]
+
+    def slowest(self, count=10):
+        return heapq.nlargest(count, self.get_all(), key=lambda r: r.get_duration())
+
+    def matching(self, regex):
+        pattern = re.compile(regex)
+        return [r for r in self.get_all() if pattern.search(r.name)]
+
+
+class DurationHistory:
+    """Remembers how long each job took in previous runs, as a moving average. It is persisted in a JSON file if a file
+    name is given, unless it is read_only (e.g. when it is shared by the executors of a sharded run, which must all
+    compute the same shards from it)."""
+
+    SMOOTHING = 0.5  # Weight of the latest duration in the moving average
+
+    def __init__(self, file_name=None, read_only=False):
+        self.file_name = file_name
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.durations = DurationHistory.load(file_name)
+
+    @staticmethod
+    def load(file_name):
+        if file_name is None or not os.path.isfile(file_name):
+            return dict()
+        try:
+            with open(file_name, 'r') as history_file:
+                return {str(k): float(v) for k, v in json.load(history_file).items()}
+        except (ValueError, AttributeError):
+            return dict()  # Unreadable history is not worth failing the run for
+
+    def get(self, name, default=None):
+        with self.lock:
+            return self.durations.get(name, default)
+
+    def get_all(self):
+        with self.lock:
+            return dict(self.durations)
+
+    def record(self, name, duration):
+        with self.lock:
+            previous = self.durations.get(name)
+            if previous is None:
+                self.durations[name] = duration
+            else:
+                self.durations[name] = DurationHistory.SMOOTHING * duration + \
+                                       (1.0 - DurationHistory.SMOOTHING) * previous
+
+    def record_results(self, job_results):
+        for job_result in job_results:
+            if job_result.start_time is not None and job_result.stop_time is not None:
+                self.record(job_result.name, job_result.get_duration())
+
+    def save(self):
+        if self.file_name is None or self.read_only:
+            return
+        temp_file_name = self.file_name + ".tmp"
+        with self.lock:
+            with open(temp_file_name, 'w') as history_file:
+                json.dump(self.durations, history_file, indent=1, sort_keys=True)
+        os.replace(temp_file_name, self.file_name)  # Atomic, so an interrupted save doesn't lose the history
+
+
+class EtaEstimator:
+    """Estimates how long until a set of runners is done. A running job's remaining time is extrapolated from the
+    progress it reported. Otherwise its duration in the DurationHistory is used, or else the average duration of the
+    jobs that are already done."""
+
+    def __init__(self, duration_history=None):
+        self.duration_history = duration_history if duration_history is not None else DurationHistory()
+
+    def estimate_remaining(self, runners, parallelism=None, now=None):
+        """Returns the estimated seconds until all runners are done, or None if nothing is known yet.
+        parallelism is the number of jobs that can run at once (None for no limit)."""
+        if now is None:
+            now = time()
+
+        done_durations = [r.stop_time - r.start_time for r in runners
+                          if r.stop_event.is_set() and r.start_time is not None and r.stop_time is not None]
+        average = sum(done_durations) / len(done_durations) if len(done_durations) > 0 else None
+
+        remaining_times = list()
+        for r in runners:
+            if r.stop_event.is_set():
+                continue
+            elapsed = now - r.start_time if r.running and r.start_time is not None else 0.0
+            fraction, message = r.get_progress()
+            if r.running and fraction is not None and fraction > 0.0:
+                remaining_times.append(elapsed * (1.0 - fraction) / fraction)
+                continue
+            expected = self.duration_history.get(r.name, average)
+            if expected is None:
+                return None
+            remaining_times.append(max(0.0, expected - elapsed))
+
+        if len(remaining_times) == 0:
+            return 0.0
+        if parallelism is None:
+            return max(remaining_times)
+        return max(max(remaining_times), sum(remaining_times) / parallelism)
+
+    @staticmethod
+    def format_duration(seconds):
+        if seconds is None:
+            return "unknown"
+        seconds = int(round(seconds))
+        return str(seconds // 3600) + ":" + str(seconds // 60 % 60).zfill(2) + ":" + str(seconds % 60).zfill(2)
+
+
+class RunnerSharder:
+    """Splits the runners of a suite deterministically into shards (e.g. one per CI executor). Runners that gate each
+    other, through start_gating_event being another runner's stop_event, stay together in one shard. Groups with
+    recorded durations are balanced by greedy bin-packing (longest first, into the least loaded shard); groups without
+    history are placed by a hash of their name."""
+
+    @staticmethod
+    def parse_shard_option(text):
+        """Parses "INDEX/COUNT" and returns (index, count). Raises ValueError if it is invalid."""
+        index_text, separator, count_text = text.partition("/")
+        index = int(index_text)
+        count = int(count_text)
+        if separator != "/" or count < 1 or not 0 <= index < count:
+            raise ValueError("expected INDEX/COUNT with 0 <= INDEX < COUNT, got " + repr(text))
+        return index, count
+
+    @staticmethod
+    def group_runners(runners):
+        """Returns a list of lists of runners that depend on each other, in the order of their first runner"""
+        parents = list(range(0, len(runners)))
+
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        index_of_stop_event = {id(r.stop_event): i for i, r in enumerate(runners)}
+        for i, r in enumerate(runners):
+            gate_index = index_of_stop_event.get(id(r.start_gating_event))
+            if r.start_gating_event is not None and gate_index is not None:
+                parents[find(i)] = find(gate_index)
+
+        groups = OrderedDict()
+        for i, r in enumerate(runners):
+            groups.setdefault(find(i), list()).append(r)
+        return list(groups.values())
+
+    @staticmethod
+    def add_gating_runners(runners, selected):
+        """Returns the selected runners and the runners they are gated on, directly or not, in the order of runners, so
+        that a selection doesn't wait forever on a runner that isn't run"""
+        runner_of_stop_event = {id(r.stop_event): r for r in runners}
+        needed = set()
+        to_visit = list(selected)
+        while len(to_visit) > 0:
+            r = to_visit.pop()
+            if id(r) in needed:
+                continue
+            needed.add(id(r))
+            if r.start_gating_event is not None and id(r.start_gating_event) in runner_of_stop_event:
+                to_visit.append(runner_of_stop_event[id(r.start_gating_event)])
+        return [r for r in runners if id(r) in needed]
+
+    @staticmethod
+    def assign_groups(groups, count, duration_history):
+        """Returns the shard index of each group"""
+        assignments = [None] * len(groups)
+        weights = [None] * len(groups)
+        for g, group in enumerate(groups):
+            durations = [duration_history.get(r.name) for r in group]
+            if None in durations:
+                assignments[g] = zlib.crc32(group[0].name.encode('utf-8')) % count
+            else:
+                weights[g] = sum(durations)
+
+        known_weights = [w for w in weights if w is not None]
+        average_weight = sum(known_weights) / len(known_weights) if len(known_weights) > 0 else 0.0
+        loads = [0.0] * count
+        for assignment in assignments:
+            if assignment is not None:
+                loads[assignment] += average_weight
+
+        known_groups = [g for g in range(0, len(groups)) if weights[g] is not None]
+        known_groups.sort(key=lambda g: (-weights[g], groups[g][0].name))
+        for g in known_groups:
+            lightest = min(range(0, count), key=lambda shard: (loads[shard], shard))
+            assignments[g] = lightest
+            loads[lightest] += weights[g]
+        return assignments
+
+    @staticmethod
+    def shard(runners, index, count, duration_history=None):
+        """Returns the runners of shard number index (counting from 0) of count shards, in their original order"""
+        runners = list(runners)
+        if duration_history is None:
+            duration_history = DurationHistory()
+        groups = RunnerSharder.group_runners(runners)
+        assignments = RunnerSharder.assign_groups(groups, count, duration_history)
+        selected = set()
+        for group, assignment in zip(groups, assignments):
+            if assignment == index:
+                selected.update(id(r) for r in group)
+        return [r for r in runners if id(r) in selected]
+
+
+class BatchDispatcher:
+    """Runs lightweight runners (see BaseJobRunner.set_lightweight()) in batches on a few worker threads, instead of
+    starting a thread per runner. Each runner is still run with its own run(), so it gets its own result, output and
+    callbacks. The batch size adapts to the observed durations so that a batch takes about TARGET_BATCH_SECONDS.
+    With a PriorityScheduler, each runner also takes one of the scheduler's worker slots while it runs, so that
+    batched and scheduled runners together stay within its max_workers."""
+
+    TARGET_BATCH_SECONDS = 0.5
+    MAX_BATCH_SIZE = 256
+    SMOOTHING = 0.2  # Weight of the latest duration in the moving average
+
+    def __init__(self, num_workers=None, duration_history=None, scheduler=None):
+        self.num_workers = num_workers if num_workers else (os.cpu_count() or 1)
+        self.duration_history = duration_history if duration_history is not None else DurationHistory()
+        self.scheduler = scheduler
+        self.lock = threading.Lock()
+        self.queue = deque()
+        self.average_duration = None
+        self.threads = list()
+
+    @staticmethod
+    def can_batch(runner):
+        """Runners that wait on a start_gating_event would hold up the rest of their batch"""
+        return runner.lightweight and runner.start_gating_event is None
+
+    def submit(self, runners):
+        history = [self.duration_history.get(r.name) for r in runners]
+        history = [d for d in history if d is not None]
+        with self.lock:
+            if self.average_duration is None and len(history) > 0:
+                self.average_duration = sum(history) / len(history)
+            for r in runners:
+                r.prepare_to_start()
+                self.queue.append(r)
+
+    def start(self):
+        for i in range(0, self.num_workers):
+            thread = threading.Thread(name="batch worker " + str(i), target=self.worker_loop)
+            self.threads.append(thread)
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def get_batch_size(self):
+        """Call with the lock held"""
+        if self.average_duration is None:
+            batch_size = 1  # Measure first
+        else:
+            batch_size = int(BatchDispatcher.TARGET_BATCH_SECONDS / max(self.average_duration, 1e-6))
+        # Don't take so much that other workers go idle at the end
+        fair_share = -(-len(self.queue) // self.num_workers)
+        return max(1, min(batch_size, BatchDispatcher.MAX_BATCH_SIZE, fair_share))
+
+    def take_batch(self):
+        with self.lock:
+            return [self.queue.popleft() for i in range(0, min(self.get_batch_size(), len(self.queue)))]
+
+    def observe_duration(self, duration):
+        with self.lock:
+            if self.average_duration is None:
+                self.average_duration = duration
+            else:
+                self.average_duration = BatchDispatcher.SMOOTHING * duration + \
+                                        (1.0 - BatchDispatcher.SMOOTHING) * self.average_duration
+
+    def worker_loop(self):
+        batch = self.take_batch()
+        while len(batch) > 0:
+            for r in batch:
+                self.run_runner(r)
+                if r.start_time is not None and r.stop_time is not None:
+                    self.observe_duration(r.stop_time - r.start_time)
+            batch = self.take_batch()
+
+    def run_runner(self, runner):
+        if self.scheduler is None:
+            runner.run()
+            return
+        runner.worker_slot = self.scheduler.acquire_slot()
+        try:
+            runner.run()
+        finally:
+            self.scheduler.release_slot(runner.worker_slot)
+            runner.worker_slot = None
+
+
+class PriorityScheduler(RunObserver):
+    """Starts submitted runners highest priority first, on at most max_workers worker slots at a time (no limit if
+    max_workers is None). A runner whose start_gating_event has not been set yet is held back so that it doesn't occupy
+    a slot while it waits: it is parked under its gate until that gate opens, rather than being looked at again on
+    every pass. Queued runners age: their effective priority rises by AGING_RATE per second of waiting, so
+    low priority runners don't starve. All queued runners age at the same rate, so the heap key
+    (AGING_RATE * enqueue time - priority) never has to be updated. Runners can be reprioritized while queued.
+    With a CpuPlacement, each started runner is also given a CPU set of runner.num_cpus CPUs to bind to, and the
+    next runner waits until that many CPUs are free."""
+
+    AGING_RATE = 1.0 / 60.0  # One priority level per minute of waiting
+    POLL_INTERVAL = 0.1  # For start gating events that are not the stop_event of a submitted runner
+
+    def __init__(self, max_workers=None, placement=None):
+        self.max_workers = max_workers
+        self.placement = placement
+        self.condition = threading.Condition()
+        self.heap = list()  # (key, sequence, runner)
+        self.queued = dict()  # id(runner) -> (key, sequence) of its valid heap entry
+        self.enqueue_times = dict()
+        self.sequence = 0
+        self.free_slots = list()  # Heap, so the lowest free slot is reused
+        self.num_slots = 0
+        self.started = set()  # id() of the runners started by this scheduler that haven't finished
+        self.cpu_sets = dict()  # id(runner) -> CPUs allocated to it by the placement
+        self.gated = dict()  # id(gate) -> (gate, heap entries of the runners held back until the gate opens)
+        self.observed_stop_events = set()  # id() of the stop_events of submitted runners, see runner_finished()
+        self.opened_gates = set()  # id() of the stop_events of submitted runners that have finished
+        self.thread = None
+        self.stopped = False
+
+    def is_ready(self, runner):
+        """Call with the lock held"""
+        gate = runner.start_gating_event
+        return gate is None or not hasattr(gate, 'is_set') or id(gate) in self.opened_gates or gate.is_set()
+
+    def get_key(self, runner):
+        """Call with the lock held"""
+        return PriorityScheduler.AGING_RATE * self.enqueue_times[id(runner)] - runner.priority
+
+    def push(self, runner, key):
+        """Call with the lock held. Any previous heap entry of the runner becomes stale."""
+        self.sequence += 1
+        self.queued[id(runner)] = (key, self.sequence)
+        heapq.heappush(self.heap, (key, self.sequence, runner))
+
+    def submit(self, runners):
+        """Queue runners to be started. They are reset right away (see BaseJobRunner.prepare_to_start())."""
+        for r in runners:
+            if self not in r.observers:
+                r.add_observer(self)
+            r.prepare_to_start()
+        with self.condition:
+            now = time()
+            for r in runners:
+                self.observed_stop_events.add(id(r.stop_event))
+                self.opened_gates.discard(id(r.stop_event))
+                self.enqueue_times[id(r)] = now
+                self.push(r, self.get_key(r))
+            self.condition.notify_all()
+
+    def is_queued(self, runner):
+        with self.condition:
+            return id(runner) in self.queued
+
+    def get_queued_runners(self):
+        """The queued runners, in the order they would start"""
+        with self.condition:
+            entries = list(self.heap)
+            for gate, gated_entries in self.gated.values():
+                entries.extend(gated_entries)
+            return [runner for key, sequence, runner in sorted(entries, key=lambda entry: entry[:2])
+                    if self.queued.get(id(runner)) == (key, sequence)]
+
+    def clear(self):
+        """Drops all the queued runners, which then never start"""
+        with self.condition:
+            self.heap = list()
+            self.gated = dict()
+            self.queued = dict()
+            self.enqueue_times = dict()
+
+    def open_gate(self, gate_id):
+        """Call with the lock held. Puts the runners parked under the gate back in the heap."""
+        gate, entries = self.gated.pop(gate_id, (None, list()))
+        for entry in entries:
+            heapq.heappush(self.heap, entry)
+
+    def poll_gates(self):
+        """Call with the lock held. Only gates that are not the stop_event of a submitted runner need polling."""
+        for gate_id, (gate, entries) in list(self.gated.items()):
+            if gate_id not in self.observed_stop_events and gate.is_set():
+                self.open_gate(gate_id)
+
+    def reprioritize(self, runner, priority):
+        with self.condition:
+            runner.priority = priority
+            if id(runner) in self.queued:
+                self.push(runner, self.get_key(runner))
+                self.condition.notify_all()
+
+    def run_next(self, runner):
+        """Give a queued runner a priority high enough to be the next one started"""
+        with self.condition:
+            if id(runner) not in self.queued:
+                return
+            lowest_key = min(key for key, sequence in self.queued.values())
+            priority = int(math.ceil(PriorityScheduler.AGING_RATE * self.enqueue_times[id(runner)] - lowest_key)) + 1
+            self.reprioritize(runner, max(runner.priority, priority))
+
+    def allocate_slot(self):
+        """Call with the lock held. Returns None if all slots are taken."""
+        if len(self.free_slots) > 0:
+            return heapq.heappop(self.free_slots)
+        if self.max_workers is not None and self.num_slots >= self.max_workers:
+            return None
+        self.num_slots += 1
+        return self.num_slots - 1
+
+    def acquire_slot(self):
+        """Waits for a free worker slot, for running a runner that this scheduler doesn't start (e.g. in a batch of a
+        BatchDispatcher). Give it back with release_slot()."""
+        with self.condition:
+            slot = self.allocate_slot()
+            while slot is None:
+                self.condition.wait()
+                slot = self.allocate_slot()
+            return slot
+
+    def release_slot(self, slot):
+        with self.condition:
+            heapq.heappush(self.free_slots, slot)
+            self.condition.notify_all()
+
+    def take_ready_runners(self):
+        """Call with the lock held. Pops the runners to start now and assigns their slots."""
+        to_start = list()
+        while len(self.heap) > 0:
+            key, sequence, runner = self.heap[0]
+            if self.queued.get(id(runner)) != (key, sequence):
+                heapq.heappop(self.heap)  # Stale entry from reprioritizing
+                continue
+            if not self.is_ready(runner):
+                gate = runner.start_gating_event
+                self.gated.setdefault(id(gate), (gate, list()))[1].append(heapq.heappop(self.heap))
+                continue
+            slot = self.allocate_slot()
+            if slot is None:
+                break
+            if self.placement is not None:
+                cpu_set = self.placement.allocate(runner.num_cpus)
+                if cpu_set is None:
+                    heapq.heappush(self.free_slots, slot)
+                    break
+                self.cpu_sets[id(runner)] = cpu_set
+                runner.cpu_set = cpu_set if self.placement.bind else None
+            heapq.heappop(self.heap)
+            del self.queued[id(runner)]
+            del self.enqueue_times[id(runner)]
+            runner.worker_slot = slot
+            self.started.add(id(runner))
+            to_start.append(runner)
+        return to_start
+
+    def runner_finished(self, runner):
+        with self.condition:
+            # The stop_event may not be set yet when observers are notified, so the gate counts as open already
+            self.opened_gates.add(id(runner.stop_event))
+            self.open_gate(id(runner.stop_event))
+            self.condition.notify_all()
+            if id(runner) not in self.started:
+                return  # Started by another scheduler (e.g. in an earlier run), which still observes it
+            self.started.discard(id(runner))
+            if runner.worker_slot is not None:
+                heapq.heappush(self.free_slots, runner.worker_slot)
+                runner.worker_slot = None
+            if id(runner) in self.cpu_sets:
+                self.placement.release(self.cpu_sets.pop(id(runner)))
+                runner.cpu_set = None
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.stopped = False
+            self.thread = threading.Thread(name="scheduler", target=self.dispatch_loop, daemon=True)
+        self.thread.start()
+
+    def dispatch_loop(self):
+        while True:
+            with self.condition:
+                if self.stopped:
+                    return
+                self.poll_gates()
+                to_start = self.take_ready_runners()
+                if len(to_start) == 0:
+                    self.condition.wait(PriorityScheduler.POLL_INTERVAL)
+            for r in to_start:
+                r.start_thread()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+            thread = self.thread
+            self.thread = None
+        if thread is not None:
+            thread.join()
+
+
+class NumaTopology:
+    """The CPUs of each NUMA node (as read from /sys/devices/system/node), limited to the CPUs this process is allowed
+    to run on. Without that information, all the allowed CPUs are on node 0."""
+
+    SYS_NODE_DIR = "/sys/devices/system/node"
+
+    def __init__(self, nodes):
+        self.nodes = nodes  # OrderedDict: node number -> sorted list of CPUs
+
+    @staticmethod
+    def parse_cpu_list(text):
+        """Parses the kernel's cpulist format, e.g. 0-3,8,10-11"""
+        cpus = list()
+        for part in text.strip().split(","):
+            if len(part) == 0:
+                continue
+            first, separator, last = part.partition("-")
+            cpus.extend(range(int(first), int(last if separator else first) + 1))
+        return cpus
+
+    @staticmethod
+    def get_allowed_cpus():
+        if hasattr(os, 'sched_getaffinity'):
+            return sorted(os.sched_getaffinity(0))
+        return list(range(0, os.cpu_count() or 1))
+
+    @staticmethod
+    def read(sys_node_dir=SYS_NODE_DIR, allowed_cpus=None):
+        allowed_cpus = set(NumaTopology.get_allowed_cpus() if allowed_cpus is None else allowed_cpus)
+        node_numbers = list()
+        if os.path.isdir(sys_node_dir):
+            for name in os.listdir(sys_node_dir):
+                match = re.fullmatch(r"node(\d+)", name)
+                if match:
+                    node_numbers.append(int(match.group(1)))
+        nodes = OrderedDict()
+        for node in sorted(node_numbers):
+            try:
+                with open(os.path.join(sys_node_dir, "node" + str(node), "cpulist")) as f:
+                    cpus = sorted(set(NumaTopology.parse_cpu_list(f.read())) & allowed_cpus)
+            except (OSError, ValueError):
+                continue
+            if len(cpus) > 0:
+                nodes[node] = cpus
+        if len(nodes) == 0:
+            nodes[0] = sorted(allowed_cpus)
+        return NumaTopology(nodes)
+
+    def get_num_cpus(self):
+        return sum(len(cpus) for cpus in self.nodes.values())
+
+    def __str__(self):
+        return ", ".join("node " + str(node) + ": " + str(len(cpus)) + " CPUs" for node, cpus in self.nodes.items())
+
+
+class CpuPlacement:
+    """Hands out CPU sets to the runners started by a PriorityScheduler, which calls it with its lock held. The CPUs
+    of a runner are packed onto one NUMA node (the one with the fewest free CPUs that still fits, to keep room for
+    bigger requests on the others), so that its memory stays local. Only a request for more CPUs than any node has is
+    spread over several nodes. A request for more CPUs than there are gets all of them. Without bind, the CPUs are
+    only counted, not bound to (e.g. to compare with the same concurrency, see --benchmark-placement)."""
+
+    def __init__(self, topology, bind=True):
+        self.topology = topology
+        self.bind = bind
+        self.free = OrderedDict((node, list(cpus)) for node, cpus in topology.nodes.items())
+        self.node_of_cpu = {cpu: node for node, cpus in topology.nodes.items() for cpu in cpus}
+        self.largest_node = max(len(cpus) for cpus in topology.nodes.values())
+
+    def allocate(self, num_cpus):
+        """Returns the allocated CPUs, or None if not enough are free yet"""
+        num_cpus = max(1, min(num_cpus, self.topology.get_num_cpus()))
+        fitting_nodes = [node for node, cpus in self.free.items() if len(cpus) >= num_cpus]
+        if len(fitting_nodes) > 0:
+            node = min(fitting_nodes, key=lambda n: len(self.free[n]))
+            return self.take(node, num_cpus)
+        if num_cpus <= self.largest_node or sum(len(cpus) for cpus in self.free.values()) < num_cpus:
+            return None  # Wait for a node to have room, or for enough CPUs to spread over
+        cpu_set = list()
+        for node in sorted(self.free.keys(), key=lambda n: -len(self.free[n])):
+            cpu_set.extend(self.take(node, min(num_cpus - len(cpu_set), len(self.free[node]))))
+        return cpu_set
+
+    def take(self, node, num_cpus):
+        cpus = self.free[node][:num_cpus]
+        del self.free[node][:num_cpus]
+        return cpus
+
+    def release(self, cpu_set):
+        for cpu in cpu_set:
+            self.free[self.node_of_cpu[cpu]].append(cpu)
+        for cpus in self.free.values():
+            cpus.sort()
+
+
+class BackgroundDeleter:
+    """Deletes files and directory trees in a background thread, so that nobody waits on an "rm -rf". Each path is
+    first renamed aside, which is instant, so it is gone (and its name free to be used again) as soon as delete()
+    returns. The thread is not a daemon, so the process finishes its deletions before it exits."""
+
+    TRASH_PREFIX = ".ppr-trash-"
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.queue = deque()
+        self.thread = None
+
+    def delete(self, path):
+        if not os.path.lexists(path):
+            return
+        trash_path = os.path.join(os.path.dirname(path), BackgroundDeleter.TRASH_PREFIX + uuid.uuid4().hex)
+        os.rename(path, trash_path)  # Same directory, so same filesystem
+        with self.condition:
+            self.queue.append(trash_path)
+            if self.thread is None:
+                self.thread = threading.Thread(name="background deleter", target=self.delete_loop)
+                self.thread.start()
+
+    def delete_loop(self):
+        while True:
+            with self.condition:
+                if len(self.queue) == 0:
+                    self.thread = None
+                    self.condition.notify_all()
+                    return
+                trash_path = self.queue.popleft()
+            if os.path.isdir(trash_path) and not os.path.islink(trash_path):
+                shutil.rmtree(trash_path, ignore_errors=True)
+            elif os.path.lexists(trash_path):
+                os.remove(trash_path)
+
+    def wait(self, timeout=None):
+        """Waits until everything queued so far is deleted. Returns True if it is."""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.thread is None, timeout)
+
+
+class ScratchManager:
+    """Provides each job with its own scratch directory (see BaseJobRunner.set_scratch_manager()). It prefers a fast
+    location (tmpfs such as /dev/shm) unless one is configured, and checks that it has at least min_free_bytes free
+    before creating a directory there, falling back to the system temp dir. Released directories are removed by a
+    BackgroundDeleter, except those of failing jobs if keep_failed is set."""
+
+    FAST_LOCATIONS = ("/dev/shm",)
+    RUN_DIR_PREFIX = "ppr-scratch-"
+
+    def __init__(self, base_dir=None, min_free_bytes=0, keep_failed=False, deleter=None):
+        self.base_dir = base_dir if base_dir is not None else ScratchManager.find_fast_location()
+        self.min_free_bytes = min_free_bytes
+        self.keep_failed = keep_failed
+        self.deleter = deleter if deleter is not None else BackgroundDeleter()
+        self.lock = threading.Lock()
+        self.run_dir_name = ScratchManager.RUN_DIR_PREFIX + uuid.uuid4().hex[:8]
+        self.run_dirs = list()
+        self.kept_dirs = list()
+
+    @staticmethod
+    def find_fast_location():
+        for location in ScratchManager.FAST_LOCATIONS:
+            if os.path.isdir(location) and os.access(location, os.W_OK):
+                return location
+        return gettempdir()
+
+    def has_room(self, location):
+        return shutil.disk_usage(location).free >= self.min_free_bytes
+
+    def get_run_dir(self):
+        """The directory for this run's scratch directories, on the first location with enough free space"""
+        for location in [self.base_dir, gettempdir()]:
+            if os.path.isdir(location) and self.has_room(location):
+                run_dir = os.path.join(location, self.run_dir_name)
+                with self.lock:
+                    if run_dir not in self.run_dirs:
+                        os.makedirs(run_dir, exist_ok=True)
+                        self.run_dirs.append(run_dir)
+                return run_dir
+        raise IOError("Less than " + str(self.min_free_bytes) + " bytes free for scratch space in " + self.base_dir +
+                      " and " + gettempdir())
+
+    def acquire(self, name):
+        safe_name = re.sub(r"[^\w.-]+", "_", name)[:64]
+        scratch_dir = os.path.join(self.get_run_dir(), safe_name + "-" + uuid.uuid4().hex[:8])
+        os.mkdir(scratch_dir)
+        return scratch_dir
+
+    def release(self, scratch_dir, passed):
+        if self.keep_failed and not passed:
+            with self.lock:
+                self.kept_dirs.append(scratch_dir)
+            return
+        self.deleter.delete(scratch_dir)
+
+    def get_kept_dirs(self):
+        with self.lock:
+            return list(self.kept_dirs)
+
+    def close(self):
+        """Removes this run's scratch space, unless it holds the scratch directories of failing jobs"""
+        with self.lock:
+            run_dirs = list(self.run_dirs)
+            kept_dirs = list(self.kept_dirs)
+        for run_dir in run_dirs:
+            if not any(kept_dir.startswith(run_dir + os.sep) for kept_dir in kept_dirs):
+                self.deleter.delete(run_dir)
+        for kept_dir in kept_dirs:
+            print("Kept scratch directory of failing job:", kept_dir)
+
+
+class ArchivedOutput:
+    """Reference to the output of one job inside an OutputArchive"""
+
+    __slots__ = ('data_file_name', 'offset', 'length')
+
+    EXTRACT_CHUNK_SIZE = 1 << 20
+
+    def __init__(self, data_file_name, offset, length):
+        self.data_file_name = data_file_name
+        self.offset = offset
+        self.length = length
+
+    def read(self):
+        """Decompresses only this job's gzip member of the archive"""
+        with open(self.data_file_name, 'rb') as data_file:
+            data_file.seek(self.offset)
+            return gzip.decompress(data_file.read(self.length)).decode('utf-8', errors='replace')
+
+    def extract(self, file_name, stop_event=None):
+        """Decompresses this job's gzip member into file_name a chunk at a time, so that a large output is never held
+        in memory. Stops early if stop_event is set."""
+        decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        with open(self.data_file_name, 'rb') as data_file, open(file_name, 'wb') as out_file:
+            data_file.seek(self.offset)
+            remaining = self.length
+            while remaining > 0 and (stop_event is None or not stop_event.is_set()):
+                data = data_file.read(min(remaining, ArchivedOutput.EXTRACT_CHUNK_SIZE))
+                if len(data) == 0:
+                    break
+                remaining -= len(data)
+                out_file.write(decompressor.decompress(data))
+            out_file.write(decompressor.flush())
+
+
+class OutputArchive:
+    """Stores the output of all the jobs of one run in a single run directory. Each job's output is appended to one
+    data file as its own gzip member, and an index file maps the job names to the offset and length of their member.
+    Re-opening an existing run directory loads its index, so the output of a run can be retrieved later."""
+
+    DATA_FILE_NAME = "output.gz"
+    INDEX_FILE_NAME = "index.jsonl"
+
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        os.makedirs(run_dir, exist_ok=True)
+        self.data_file_name = os.path.join(run_dir, OutputArchive.DATA_FILE_NAME)
+        self.index_file_name = os.path.join(run_dir, OutputArchive.INDEX_FILE_NAME)
+        self.lock = threading.Lock()
+        self.entries = self.load_index(self.index_file_name, self.data_file_name)
+        self.data_file = open(self.data_file_name, 'ab')
+        self.index_file = open(self.index_file_name, 'a')
+
+    @staticmethod
+    def create_run_dir_name(archive_dir):
+        return os.path.join(archive_dir, "run-" + strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:8])
+
+    @staticmethod
+    def load_index(index_file_name, data_file_name):
+        entries = dict()
+        if not os.path.isfile(index_file_name):
+            return entries
+        with open(index_file_name, 'r') as index_file:
+            for line in index_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Partially written last line of an interrupted run
+                entries[record['name']] = ArchivedOutput(data_file_name, record['offset'], record['length'])
+        return entries
+
+    def write(self, name, output):
+        data = gzip.compress(output.encode('utf-8'))
+        with self.lock:
+            self.data_file.seek(0, os.SEEK_END)
+            offset = self.data_file.tell()
+            self.data_file.write(data)
+            self.data_file.flush()
+            entry = ArchivedOutput(self.data_file_name, offset, len(data))
+            self.index_file.write(json.dumps({'name': name, 'offset': offset, 'length': len(data)}) + "\n")
+            self.index_file.flush()
+            self.entries[name] = entry
+        return entry
+
+    def get_names(self):
+        with self.lock:
+            return list(self.entries.keys())
+
+    def get(self, name):
+        with self.lock:
+            return self.entries.get(name)
+
+    def read(self, name):
+        entry = self.get(name)
+        return "" if entry is None else entry.read()
+
+    def close(self):
+        with self.lock:
+            self.data_file.close()
+            self.index_file.close()
+
+
+class RunJournal:
+    """Append-only journal of a run, so that an interrupted run can be resumed. A JSON line is written when each job
+    starts and when it finishes (with its result and where its output is). Lines are flushed right away and fsync'ed
+    in batches, every FSYNC_BATCH lines or FSYNC_INTERVAL seconds, so a crash loses at most the last few lines."""
+
+    FSYNC_BATCH = 64
+    FSYNC_INTERVAL = 1.0
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        self.journal_file = open(file_name, 'a')
+        self.num_unsynced = 0
+        self.last_sync_time = time()
+        self.write_record({'event': 'run', 'time': time()})
+
+    def write_record(self, record):
+        with self.lock:
+            self.journal_file.write(json.dumps(record) + "\n")
+            self.journal_file.flush()
+            self.num_unsynced += 1
+            if self.num_unsynced >= RunJournal.FSYNC_BATCH or time() - self.last_sync_time >= RunJournal.FSYNC_INTERVAL:
+                self.sync_unlocked()
+
+    def sync_unlocked(self):
+        os.fsync(self.journal_file.fileno())
+        self.num_unsynced = 0
+        self.last_sync_time = time()
+
+    def record_start(self, name):
+        self.write_record({'event': 'start', 'name': name, 'time': time()})
+
+    def record_finish(self, job_result):
+        self.write_record({'event': 'finish', 'name': job_result.name, 'status': int(job_result.status),
+                           'return_code': job_result.return_code, 'start_time': job_result.start_time,
+                           'stop_time': job_result.stop_time, 'classification': job_result.classification,
+                           'output': RunJournal.encode_output_file(job_result.output_file)})
+
+    def close(self):
+        with self.lock:
+            if self.num_unsynced > 0:
+                self.sync_unlocked()
+            self.journal_file.close()
+
+    @staticmethod
+    def encode_output_file(output_file):
+        if isinstance(output_file, ArchivedOutput):
+            return {'archive': output_file.data_file_name, 'offset': output_file.offset, 'length': output_file.length}
+        return {'file': output_file}
+
+    @staticmethod
+    def decode_output_file(encoded):
+        if 'archive' in encoded:
+            return ArchivedOutput(encoded['archive'], encoded['offset'], encoded['length'])
+        return encoded.get('file')
+
+    @staticmethod
+    def load_results(file_name):
+        """Returns the JobResults of the jobs that finished, according to the journal, in the order they finished"""
+        results = OrderedDict()
+        with open(file_name, 'r') as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Partially written line from when the run was interrupted
+                if record.get('event') != 'finish':
+                    continue
+                results.pop(record['name'], None)  # A job that finished again (e.g. re-run) moves to the end
+                results[record['name']] = JobResult(record['name'], JobStatus(record['status']),
+                                                    record['return_code'], record['start_time'],
+                                                    record['stop_time'],
+                                                    RunJournal.decode_output_file(record['output']),
+                                                    record.get('classification', ""))
+        return list(results.values())
+
+
+class Histogram:
+    """A histogram with fixed buckets, rendered in the Prometheus text format"""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # The last one is for values above all the buckets
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name, help_text):
+        lines = ["# HELP " + name + " " + help_text, "# TYPE " + name + " histogram"]
+        cumulative_count = 0
+        for bucket, bucket_count in zip(self.buckets + ["+Inf"], self.bucket_counts):
+            cumulative_count += bucket_count
+            lines.append(name + '_bucket{le="' + str(bucket) + '"} ' + str(cumulative_count))
+        lines.append(name + "_sum " + repr(self.sum))
+        lines.append(name + "_count " + str(self.count))
+        return lines
+
+
+class RunMetrics(RunObserver):
+    """Live statistics of a run, updated incrementally as runners are queued, start and finish (rather than by scanning
+    all the runners), and rendered in the Prometheus text format."""
+
+    DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, 4 * 3600)
+    JOBS_PER_MINUTE_WINDOW = 60.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queued = set()
+        self.running = set()
+        self.passed = 0
+        self.failed = 0
+        self.job_duration = Histogram(RunMetrics.DURATION_BUCKETS)
+        self.gate_wait = Histogram(RunMetrics.DURATION_BUCKETS)
+        self.recent_finish_times = deque()
+
+    def runner_queued(self, runner):
+        with self.lock:
+            self.queued.add(id(runner))
+
+    def runner_started(self, runner):
+        with self.lock:
+            self.queued.discard(id(runner))
+            self.running.add(id(runner))
+            self.gate_wait.observe(runner.gate_opened_time - runner.gate_wait_start_time)
+
+    def runner_finished(self, runner):
+        now = time()
+        with self.lock:
+            self.running.discard(id(runner))
+            if runner.status == JobStatus.PASSED:
+                self.passed += 1
+            else:
+                self.failed += 1
+            if runner.start_time is not None and runner.stop_time is not None:
+                self.job_duration.observe(runner.stop_time - runner.start_time)
+            self.recent_finish_times.append(now)
+            self.prune_recent_finish_times(now)
+
+    def prune_recent_finish_times(self, now):
+        """Call with the lock held"""
+        while len(self.recent_finish_times) > 0 \
+                and self.recent_finish_times[0] < now - RunMetrics.JOBS_PER_MINUTE_WINDOW:
+            self.recent_finish_times.popleft()
+
+    def get_jobs_per_minute(self, now=None):
+        with self.lock:
+            self.prune_recent_finish_times(time() if now is None else now)
+            return len(self.recent_finish_times) * 60.0 / RunMetrics.JOBS_PER_MINUTE_WINDOW
+
+    def render(self):
+        jobs_per_minute = self.get_jobs_per_minute()
+        with self.lock:
+            lines = list()
+            for name, metric_type, help_text, value in [
+                    ("ppr_jobs_queued", "gauge", "Jobs waiting to start (including on a start gating event)",
+                     len(self.queued)),
+                    ("ppr_jobs_running", "gauge", "Jobs running", len(self.running)),
+                    ("ppr_jobs_passed_total", "counter", "Jobs that passed", self.passed),
+                    ("ppr_jobs_failed_total", "counter", "Jobs that failed", self.failed),
+                    ("ppr_jobs_per_minute", "gauge", "Jobs finished in the last minute", jobs_per_minute)]:
+                lines += ["# HELP " + name + " " + help_text, "# TYPE " + name + " " + metric_type,
+                          name + " " + str(value)]
+            lines += self.job_duration.render("ppr_job_duration_seconds", "How long jobs ran")
+            lines += self.gate_wait.render("ppr_gate_wait_seconds", "How long jobs waited on their start gating event")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Serves RunMetrics over HTTP on localhost (for Prometheus or a dashboard) and/or writes them periodically to a
+    snapshot file. Both run in daemon threads."""
+
+    SNAPSHOT_INTERVAL = 5.0
+
+    def __init__(self, metrics, port=None, snapshot_file_name=None):
+        self.metrics = metrics
+        self.port = port
+        self.snapshot_file_name = snapshot_file_name
+        self.server = None
+        self.stop_event = threading.Event()
+        self.snapshot_thread = None
+
+    def build_request_handler(self):
+        metrics = self.metrics
+
+        class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # Don't clutter the output of the run
+
+        return MetricsRequestHandler
+
+    def start(self):
+        if self.port is not None:
+            self.server = http.server.ThreadingHTTPServer(("127.0.0.1", self.port), self.build_request_handler())
+            self.port = self.server.server_address[1]  # In case port 0 was given
+            threading.Thread(name="metrics server", target=self.server.serve_forever, daemon=True).start()
+        if self.snapshot_file_name is not None:
+            self.snapshot_thread = threading.Thread(name="metrics snapshot", target=self.snapshot_loop, daemon=True)
+            self.snapshot_thread.start()
+
+    def snapshot_loop(self):
+        while not self.stop_event.wait(MetricsExporter.SNAPSHOT_INTERVAL):
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        temp_file_name = self.snapshot_file_name + ".tmp"
+        with open(temp_file_name, 'w') as snapshot_file:
+            snapshot_file.write(self.metrics.render())
+        os.replace(temp_file_name, self.snapshot_file_name)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.snapshot_file_name is not None:
+            self.write_snapshot()  # Final state of the run
+
+
+class TraceWriter(RunObserver):
+    """Writes a timeline of the run as Chrome trace-event JSON, which opens in Perfetto (ui.perfetto.dev) or
+    chrome://tracing. Each job's running and callback phases are drawn on the lane of the worker slot it ran on, and
+    its queued and gated phases as async spans of a separate "Queue" process. Counter tracks show how many jobs were
+    running and waiting. Events are written as they happen, so the trace is not held in memory."""
+
+    WORKER_PID = 1
+    QUEUE_PID = 2
+
+    def __init__(self, file_name):
+        self.lock = threading.Lock()
+        self.trace_file = open(file_name, 'w')
+        self.trace_file.write("[\n")
+        self.closed = False
+        self.first_event = True
+        self.origin_time = time()
+        self.free_lanes = list()  # Heap, so the lowest free lane is reused
+        self.num_lanes = 0
+        self.lanes = dict()
+        self.num_waiting = 0
+        self.num_running = 0
+        self.next_async_id = 0
+        self.write_event({'ph': 'M', 'name': 'process_name', 'pid': TraceWriter.WORKER_PID,
+                          'args': {'name': "Workers"}})
+        self.write_event({'ph': 'M', 'name': 'process_name', 'pid': TraceWriter.QUEUE_PID,
+                          'args': {'name': "Queue"}})
+
+    def get_timestamp(self, t):
+        """Microseconds since the trace started"""
+        return int((t - self.origin_time) * 1e6)
+
+    def write_event(self, event):
+        """Call with the lock held (or from __init__). Events that arrive after close() are dropped."""
+        if self.closed:
+            return
+        self.trace_file.write(("" if self.first_event else ",\n") + json.dumps(event))
+        self.first_event = False
+
+    def write_span(self, name, category, start_time, stop_time, lane, args=None):
+        if start_time is None or stop_time is None:
+            return
+        event = {'ph': 'X', 'name': name, 'cat': category, 'pid': TraceWriter.WORKER_PID, 'tid': lane,
+                 'ts': self.get_timestamp(start_time), 'dur': max(0, self.get_timestamp(stop_time) -
+                                                                   self.get_timestamp(start_time))}
+        if args is not None:
+            event['args'] = args
+        self.write_event(event)
+
+    def write_async_span(self, name, category, start_time, stop_time):
+        if start_time is None or stop_time is None:
+            return
+        self.next_async_id += 1
+        for phase, t in [('b', start_time), ('e', stop_time)]:
+            self.write_event({'ph': phase, 'name': name, 'cat': category, 'pid': TraceWriter.QUEUE_PID,
+                              'id': self.next_async_id, 'ts': self.get_timestamp(t)})
+
+    def write_counters(self, t):
+        self.write_event({'ph': 'C', 'name': "concurrency", 'pid': TraceWriter.WORKER_PID, 'ts': self.get_timestamp(t),
+                          'args': {'running': self.num_running, 'waiting': self.num_waiting}})
+
+    def allocate_lane(self):
+        if len(self.free_lanes) > 0:
+            return heapq.heappop(self.free_lanes)
+        lane = self.num_lanes
+        self.num_lanes += 1
+        self.write_event({'ph': 'M', 'name': 'thread_name', 'pid': TraceWriter.WORKER_PID, 'tid': lane,
+                          'args': {'name': "slot " + str(lane)}})
+        return lane
+
+    def runner_queued(self, runner):
+        with self.lock:
+            self.num_waiting += 1
+            self.write_counters(runner.queued_time)
+
+    def runner_started(self, runner):
+        with self.lock:
+            if runner.queued_time is not None:
+                self.num_waiting -= 1
+                self.write_async_span(runner.name + " (queued)", "queued", runner.queued_time,
+                                      runner.gate_wait_start_time)
+            if runner.start_gating_event is not None:
+                self.write_async_span(runner.name + " (gated)", "gated", runner.gate_wait_start_time,
+                                      runner.gate_opened_time)
+            self.num_running += 1
+            self.lanes[id(runner)] = self.allocate_lane()
+            self.write_counters(runner.gate_opened_time)
+
+    def runner_finished(self, runner):
+        with self.lock:
+            lane = self.lanes.pop(id(runner), 0)
+            self.write_span(runner.name, "running", runner.gate_opened_time, runner.stop_time, lane,
+                            {'result': runner.result_message})
+            self.write_span(runner.name + " (callback)", "callback", runner.stop_time,
+                            runner.stop_callback_done_time, lane)
+            heapq.heappush(self.free_lanes, lane)
+            self.num_running -= 1
+            self.write_counters(runner.stop_callback_done_time)
+            if not self.closed:
+                self.trace_file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.trace_file.write("\n]\n")
+            self.trace_file.close()
+
 
 class Cli:
     """ The (C)ommand (L)ine (I)nterface part of the app, for when running with the GUI
     is not desired."""
 
-    def __init__(self, runners):
-        self.runners = runners
-
+    STATUS_INTERVAL = 10.0
+
+    def __init__(self, runners, output_file_dir="", output_archive=None, duration_history=None,
+                 batch_dispatcher=None, journal=None, resumed_results=None, scheduler=None):
+        self.batch_dispatcher = batch_dispatcher
+        self.scheduler = scheduler
+        self.runners_by_name = dict()
+        self.output_archive = output_archive
+        self.duration_history = duration_history if duration_history is not None else DurationHistory()
+        self.eta_estimator = EtaEstimator(self.duration_history)
+        self.journal = journal
+
+        # Jobs that finished in the interrupted run being resumed are reported, but not run again. They are restored
+        # as finished, so that the jobs gated on them still start.
+        self.resumed_results = resumed_results if resumed_results is not None else list()
+        resumed_results_by_name = {job_result.name: job_result for job_result in self.resumed_results}
+        self.runners = list()
         for r in runners:
+            if r.name in resumed_results_by_name:
+                r.restore(resumed_results_by_name[r.name])
+            else:
+                self.runners.append(r)
+
+        for r in self.runners:
             r.set_start_callback(self.call_when_runner_starts)
             r.set_stop_callback(self.call_when_runner_stops)
+            self.runners_by_name[r.name] = r
+
+        if output_file_dir == "":
+            output_file_dir = gettempdir()
+        self.output_file_dir = output_file_dir
 
-        self.result_info_list = list()
+        self.result_store = ResultStore()
+        self.run_group = RunGroup()
+        for job_result in self.resumed_results:
+            self.result_store.add(job_result)
 
         self.start_callback_sema = threading.BoundedSemaphore()
         self.stop_callback_sema = threading.BoundedSemaphore()
 
     def call_when_runner_starts(self, name):
+        if self.journal is not None:
+            self.journal.record_start(name)
         with self.start_callback_sema:
             print(name, "starting...")
 
     def call_when_runner_stops(self, name, result_message, output):
+        output_file_name = self.write_output_to_file(name, output)
+        runner = self.runners_by_name[name]
+        runner.release_output()
         with self.stop_callback_sema:
             print(name, "finished.")
-            self.result_info_list.append((name, result_message, output))
+            job_result = self.result_store.record_runner(runner, output_file_name)
+        if self.journal is not None:
+            self.journal.record_finish(job_result)
+
+    def write_output_to_file(self, name, output):
+        if self.output_archive is not None:
+            return self.output_archive.write(name, output)
+        output_file_name = self.output_file_dir + "/" + str(uuid.uuid4()) + ".txt"  # UUID is unique
+        with open(output_file_name, 'w') as output_file:
+            output_file.write(output)
+        return output_file_name
 
     def display_result_info(self):
         max_len = 0
-        for name, result_message, output in self.result_info_list:
-            max_len = max(max_len, len(name), len(result_message))
-            output_lines = output.split("\n")
+        for job_result in self.result_store:
+            max_len = max(max_len, len(job_result.name), len(job_result.get_result_message()))
+            output_lines = job_result.read_output().split("\n")
             for line in output_lines:
                 max_len = max(max_len, len(line))
 
@@ -166,22 +1929,19 @@ class Cli:
         for i in range(0, max_len + 2):  # + 2 to match leading "# "
             separator += "#"
 
-        for name, result_message, output in self.result_info_list:
-            output_lines = output.split("\n")
+        for job_result in self.result_store:
+            output_lines = job_result.read_output().split("\n")
             print("\n\n")
             print(separator)
-            print("#", name)
+            print("#", job_result.name)
             print(separator)
-            print("# Result:", result_message)
+            print("# Result:", job_result.get_result_message())
             print(separator)
             for line in output_lines:
                 print("#", line)
 
     def get_exit_return_code(self):
-        failing_jobs = list()
-        for name, result_message, output in self.result_info_list:
-            if "Success" not in result_message:
-                failing_jobs.append(name)
+        failing_jobs = [job_result.name for job_result in self.result_store.failing()]
 
         print("\n\n")
 
@@ -198,16 +1958,556 @@ class Cli:
         if failures_detected:
             sys.exit(1)
 
+    def clean_up_files(self):
+        if self.output_archive is not None:
+            self.output_archive.close()
+            print("Output archived in", self.output_archive.run_dir)
+        if self.journal is not None:
+            self.journal.close()
+            return  # Keep the output files that the journal refers to
+        for job_result in self.result_store:
+            if isinstance(job_result.output_file, str) and os.path.isfile(job_result.output_file):
+                os.remove(job_result.output_file)
+
+    def get_status_line(self):
+        num_done = 0
+        num_running = 0
+        num_failed = 0
+        progress_fractions = list()
+        for r in self.runners:
+            if r.stop_event.is_set():
+                num_done += 1
+                num_failed += 0 if r.status == JobStatus.PASSED else 1
+            elif r.running:
+                num_running += 1
+                fraction, message = r.get_progress()
+                if fraction is not None:
+                    progress_fractions.append(fraction)
+        line = "[status] " + str(num_done) + "/" + str(len(self.runners)) + " done, " + \
+               str(num_running) + " running, " + str(len(self.runners) - num_done - num_running) + " waiting, " + \
+               str(num_failed) + " failed"
+        if len(progress_fractions) > 0:
+            line += ", running jobs " + str(int(100 * sum(progress_fractions) / len(progress_fractions))) + "% done"
+        return line + ", ETA " + EtaEstimator.format_duration(self.estimate_remaining())
+
+    def estimate_remaining(self):
+        """Batched runners share the scheduler's -j limit if there is one, otherwise the batch workers"""
+        if self.scheduler is not None and self.scheduler.max_workers is not None:
+            return self.eta_estimator.estimate_remaining(self.runners, self.scheduler.max_workers)
+        if self.batch_dispatcher is None:
+            return self.eta_estimator.estimate_remaining(self.runners)
+        batched = [r for r in self.runners if BatchDispatcher.can_batch(r)]
+        unbatched = [r for r in self.runners if not BatchDispatcher.can_batch(r)]
+        remaining = [self.eta_estimator.estimate_remaining(batched, self.batch_dispatcher.num_workers),
+                     self.eta_estimator.estimate_remaining(unbatched)]
+        return None if None in remaining else max(remaining)
+
+    def status_loop(self):
+        while not self.run_group.wait_all(Cli.STATUS_INTERVAL):
+            print(self.get_status_line())
+
     def run(self):
+        for job_result in self.resumed_results:
+            print(job_result.name, "already finished:", job_result.get_result_message())
+
+        self.run_group = RunGroup(self.runners)
+        batched_runners = list()
+        scheduled_runners = list()
         for r in self.runners:
             print(r.name, "is waiting to start...")
-            r.start()
+            if self.batch_dispatcher is not None and BatchDispatcher.can_batch(r):
+                batched_runners.append(r)
+            elif self.scheduler is not None:
+                scheduled_runners.append(r)
+            else:
+                r.start()
 
-        for r in self.runners:
-            r.stop_event.wait()
+        if len(batched_runners) > 0:
+            self.batch_dispatcher.submit(batched_runners)
+            self.batch_dispatcher.start()
+
+        if len(scheduled_runners) > 0:
+            self.scheduler.submit(scheduled_runners)
+            self.scheduler.start()
+
+        status_thread = threading.Thread(name="status", target=self.status_loop, daemon=True)
+        status_thread.start()
+
+        self.run_group.wait_all()
+        self.run_group.close()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+
+        self.duration_history.record_results(self.result_store.get_all()[len(self.resumed_results):])
+        self.duration_history.save()
 
         self.display_result_info()
-        sys.exit(self.get_exit_return_code())
+        try:
+            sys.exit(self.get_exit_return_code())
+        finally:
+            self.clean_up_files()
+
+
+class SelectionFilter:
+    """Works out which runners a selection filter selects. A filter is a regex on the runner names, optionally
+    combined with "tag:NAME" and "attr:KEY=VALUE" (or "attr:KEY") terms that must all match the runner's metadata.
+    Literal and "^literal" prefix patterns are answered from a precomputed index of the names without a regex scan,
+    tag and attribute terms from inverted indexes, and results are cached per filter string."""
+
+    CACHE_SIZE = 256
+    METADATA_TERM = re.compile(r"(?:^|\s)(tag|attr):(\S+)")
+    REGEX_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
+
+    def __init__(self, names, tags_list=None, attributes_list=None):
+        self.names = list(names)
+        self.all_indices = frozenset(range(0, len(self.names)))
+        sorted_names = sorted((name, i) for i, name in enumerate(self.names))
+        self.sorted_names = [name for name, i in sorted_names]
+        self.sorted_indices = [i for name, i in sorted_names]
+
+        self.tag_index = dict()
+        for i, tags in enumerate(tags_list if tags_list is not None else list()):
+            for tag in tags:
+                self.tag_index.setdefault(tag, set()).add(i)
+
+        self.attribute_index = dict()
+        self.attribute_key_index = dict()
+        for i, attributes in enumerate(attributes_list if attributes_list is not None else list()):
+            for key, value in attributes.items():
+                self.attribute_index.setdefault((key, str(value)), set()).add(i)
+                self.attribute_key_index.setdefault(key, set()).add(i)
+
+        self.cache = OrderedDict()
+
+    @staticmethod
+    def from_runners(runners):
+        return SelectionFilter([r.name for r in runners], [r.tags for r in runners], [r.attributes for r in runners])
+
+    def get_selected(self, filter_string):
+        """Returns the frozenset of the indices of the selected names. Raises re.error for an invalid regex."""
+        if filter_string in self.cache:
+            self.cache.move_to_end(filter_string)
+            return self.cache[filter_string]
+
+        selected = self.all_indices
+        for kind, value in SelectionFilter.METADATA_TERM.findall(filter_string):
+            selected = selected & (self.match_tag(value) if kind == "tag" else self.match_attribute(value))
+        regex = SelectionFilter.METADATA_TERM.sub(" ", filter_string).strip()
+        if regex != "":
+            selected = selected & self.match_names(regex)
+
+        self.cache[filter_string] = selected
+        if len(self.cache) > SelectionFilter.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return selected
+
+    def match_tag(self, tag):
+        return self.tag_index.get(tag, set())
+
+    def match_attribute(self, term):
+        if "=" in term:
+            key, value = term.split("=", 1)
+            return self.attribute_index.get((key, value), set())
+        return self.attribute_key_index.get(term, set())
+
+    @staticmethod
+    def is_literal(regex):
+        return not any(c in SelectionFilter.REGEX_METACHARACTERS for c in regex)
+
+    def match_names(self, regex):
+        if SelectionFilter.is_literal(regex):
+            return frozenset(i for i, name in enumerate(self.names) if regex in name)
+        if regex.startswith("^") and SelectionFilter.is_literal(regex[1:]):
+            return self.match_prefix(regex[1:])
+        pattern = re.compile(regex)
+        return frozenset(i for i, name in enumerate(self.names) if pattern.search(name))
+
+    def match_prefix(self, prefix):
+        first = bisect_left(self.sorted_names, prefix)
+        last = first
+        while last < len(self.sorted_names) and self.sorted_names[last].startswith(prefix):
+            last += 1
+        return frozenset(self.sorted_indices[first:last])
+
+
+class LogFileIndex:
+    """Memory-maps a (possibly multi-GB and possibly still growing) text file and indexes the offsets at which its
+    lines start, so that any window of lines can be read without reading the whole file. A live file (one that is
+    still being written, and may be truncated or replaced when its job is run again) is read with pread() instead,
+    because reading a map past the new end of a truncated file raises SIGBUS."""
+
+    NEWLINE = re.compile(b"\n")
+    SEARCH_CHUNK_SIZE = 1 << 24
+
+    def __init__(self, file_name, live=False):
+        self.file_name = file_name
+        self.live = live
+        self.lock = threading.Lock()
+        self.file = None
+        self.mmap = None
+        self.size = 0
+        self.indexed_size = 0
+        self.line_offsets = array('Q', [0])  # Offset of the start of each line
+
+    def refresh(self):
+        """Re-map the file if it has changed size, or been replaced. Returns True if it did."""
+        try:
+            stat = os.stat(self.file_name)
+        except OSError:
+            stat = None
+        size = stat.st_size if stat is not None else 0
+        replaced = stat is not None and self.file is not None and os.fstat(self.file.fileno()).st_ino != stat.st_ino
+        if size == self.size and not replaced:
+            return False
+        # Files and maps that are replaced here are not closed explicitly; a reader may still be using one, and it is
+        # closed when the last reference goes away.
+        new_file = open(self.file_name, 'rb') if (self.file is None or replaced) and size > 0 else self.file
+        new_mmap = None
+        if not self.live and size > 0:
+            new_mmap = mmap.mmap(new_file.fileno(), 0, access=mmap.ACCESS_READ)
+            size = len(new_mmap)
+        with self.lock:
+            if size < self.size or replaced:  # Truncated or replaced, so start over
+                self.indexed_size = 0
+                self.line_offsets = array('Q', [0])
+            self.file = new_file
+            self.mmap = new_mmap
+            self.size = size
+        return True
+
+    def get_source(self):
+        """Call with the lock held. What read() reads from: the map, or for a live file the file itself."""
+        return self.file if self.live else self.mmap
+
+    def read(self, source, start, end):
+        """Returns the bytes from start to end, fewer if a live file has been truncated since"""
+        if source is None:
+            return b""
+        if self.live:
+            try:
+                return os.pread(source.fileno(), end - start, start)
+            except (ValueError, OSError):
+                return b""  # Closed by close() meanwhile
+        return source[start:end]
+
+    def index_some(self, max_bytes=1 << 24):
+        """Index up to max_bytes of content that has not been indexed yet. Returns True when the index is complete."""
+        with self.lock:
+            start = self.indexed_size
+            end = min(self.size, start + max_bytes)
+            source = self.get_source()
+            if source is None or start >= end:
+                return True
+            data = self.read(source, start, end)
+            self.line_offsets.extend(start + m.end() for m in LogFileIndex.NEWLINE.finditer(data))
+            self.indexed_size = start + len(data)
+            if len(data) < end - start:  # Truncated since refresh()
+                self.size = self.indexed_size
+            return self.indexed_size >= self.size
+
+    def is_complete(self):
+        with self.lock:
+            return self.indexed_size >= self.size
+
+    def get_line_count(self):
+        with self.lock:
+            return self.get_line_count_unlocked()
+
+    def get_line_count_unlocked(self):
+        if self.line_offsets[-1] >= self.indexed_size:
+            return len(self.line_offsets) - 1  # Empty file, or the last line ends with a newline
+        return len(self.line_offsets)
+
+    def get_lines(self, first_line, count):
+        with self.lock:
+            source = self.get_source()
+            last_line = min(first_line + count, self.get_line_count_unlocked())
+            end_offsets = [self.line_offsets[i + 1] if i + 1 < len(self.line_offsets) else self.indexed_size
+                           for i in range(first_line, last_line)]
+            start_offsets = self.line_offsets[first_line:last_line]
+        if len(start_offsets) == 0:
+            return list()
+        data = self.read(source, start_offsets[0], end_offsets[-1])
+        return [data[start - start_offsets[0]:end - start_offsets[0]].decode('utf-8', errors='replace').rstrip("\r\n")
+                for start, end in zip(start_offsets, end_offsets)]
+
+    def get_line_of_offset(self, offset):
+        return bisect_right(self.line_offsets, offset) - 1
+
+    def get_chunk_end(self, start, limit):
+        """The start of a line about SEARCH_CHUNK_SIZE after start, or limit, so that a chunk doesn't split a line"""
+        if limit - start <= LogFileIndex.SEARCH_CHUNK_SIZE:
+            return limit
+        end = self.line_offsets[self.get_line_of_offset(start + LogFileIndex.SEARCH_CHUNK_SIZE)]
+        return end if end > start else limit
+
+    def search(self, pattern, from_line, backwards=False):
+        """Returns the number of the first line after (or the last line before) from_line that pattern (a compiled
+        bytes regex) matches, or None. Only indexed content is searched, a chunk of lines at a time."""
+        with self.lock:
+            source = self.get_source()
+            indexed_size = self.indexed_size
+            line_count = self.get_line_count_unlocked()
+        if source is None:
+            return None
+        if backwards:
+            if from_line <= 0:
+                return None
+            end = self.line_offsets[min(from_line, len(self.line_offsets) - 1)]
+            while end > 0:
+                start = self.line_offsets[self.get_line_of_offset(max(0, end - LogFileIndex.SEARCH_CHUNK_SIZE))]
+                last_match = None
+                for last_match in pattern.finditer(self.read(source, start, end)):
+                    pass
+                if last_match is not None:
+                    return self.get_line_of_offset(start + last_match.start())
+                end = start
+            return None
+        if from_line + 1 >= line_count:
+            return None
+        start = self.line_offsets[from_line + 1]
+        while start < indexed_size:
+            end = self.get_chunk_end(start, indexed_size)
+            match = pattern.search(self.read(source, start, end))
+            if match is not None:
+                return self.get_line_of_offset(start + match.start())
+            start = end
+        return None
+
+    def close(self):
+        with self.lock:
+            self.mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class LogViewer:
+    """A window that shows a job's output file. The file is memory-mapped and indexed by a background thread, and
+    only the lines that are visible are ever read, so large logs open instantly. Supports regex search, jumping to the
+    end, and following a file that is still being written. With an archived_output (see ArchivedOutput), the
+    indexing thread first extracts it into a temporary file, which is deleted when the viewer is closed."""
+
+    POLL_MS = 200
+    SEARCH_DELAY_MS = 300
+
+    def __init__(self, master, file_name, title, follow=False, archived_output=None):
+        self.archived_output = archived_output
+        self.extracting = archived_output is not None  # Read by the Tk thread, so not a Tk variable
+        if archived_output is not None:
+            file_descriptor, file_name = mkstemp(prefix="output-", suffix=".txt")
+            os.close(file_descriptor)
+        self.index = LogFileIndex(file_name, live=follow)
+        self.closed = threading.Event()
+        self.following = follow  # Read by the indexing thread, so not a Tk variable
+        self.first_line = 0
+        self.visible_lines = 40
+        self.line_count = 0
+        self.match_line = None
+        self.search_pattern = None
+        self.search_thread = None
+        self.search_result = None
+        self.pending_search_id = None
+        self.drawn_state = None
+
+        self.window = tk.Toplevel(master)
+        self.window.title(title)
+        Gui.configure_expansion(self.window, 1, 0)
+
+        self.controls_frame = tk.Frame(self.window)
+        self.controls_frame.grid(row=0, column=0, columnspan=2, sticky=tk.NSEW)
+        Gui.configure_column_expansion(self.controls_frame, 0)
+
+        self.search_string_var = tk.StringVar()
+        self.search_string_var.trace("w", lambda name, index, mode: self.search_text_update_callback())
+        self.search_entry = tk.Entry(self.controls_frame, textvariable=self.search_string_var)
+        self.search_entry.grid(row=0, column=0, sticky=tk.NSEW)
+        self.search_entry.bind("<Return>", lambda event: self.find_next())
+        self.search_entry.bind("<Shift-Return>", lambda event: self.find_previous())
+        tk.Button(self.controls_frame, text="Prev", command=self.find_previous).grid(row=0, column=1)
+        tk.Button(self.controls_frame, text="Next", command=self.find_next).grid(row=0, column=2)
+        tk.Button(self.controls_frame, text="End", command=self.jump_to_end).grid(row=0, column=3)
+        self.follow_var = tk.IntVar()
+        self.follow_var.set(1 if follow else 0)
+        tk.Checkbutton(self.controls_frame, text="Follow", variable=self.follow_var,
+                       command=self.follow_toggled).grid(row=0, column=4)
+
+        self.text = tk.Text(self.window, wrap=tk.NONE, font="TkFixedFont", height=self.visible_lines, width=120)
+        self.text.tag_configure("match", background="yellow")
+        self.text.grid(row=1, column=0, sticky=tk.NSEW)
+        self.v_bar = tk.Scrollbar(self.window, orient=tk.VERTICAL, command=self.scroll_command)
+        self.v_bar.grid(row=1, column=1, sticky=tk.NS)
+        self.h_bar = tk.Scrollbar(self.window, orient=tk.HORIZONTAL, command=self.text.xview)
+        self.h_bar.grid(row=2, column=0, sticky=tk.EW)
+        self.text.config(xscrollcommand=self.h_bar.set, state=tk.DISABLED)
+
+        self.status_label = tk.Label(self.window, anchor=tk.W)
+        self.status_label.grid(row=3, column=0, columnspan=2, sticky=tk.NSEW)
+
+        self.text.bind("<Configure>", self.text_configure_callback)
+        self.text.bind("<Button-4>", lambda event: self.scroll_lines(-3))
+        self.text.bind("<Button-5>", lambda event: self.scroll_lines(3))
+        self.window.bind("<Prior>", lambda event: self.scroll_lines(-self.visible_lines))
+        self.window.bind("<Next>", lambda event: self.scroll_lines(self.visible_lines))
+        self.window.bind("<Control-Home>", lambda event: self.set_first_line(0))
+        self.window.bind("<Control-End>", lambda event: self.jump_to_end())
+        self.window.bind("<Escape>", lambda event: self.close())
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.index_thread = threading.Thread(name="index " + file_name, target=self.index_loop, daemon=True)
+        self.index_thread.start()
+        self.window.after(LogViewer.POLL_MS, self.poll)
+
+    def index_loop(self):
+        """Runs in a background thread: indexes the file, then keeps checking whether it grows"""
+        if self.archived_output is not None:
+            self.archived_output.extract(self.index.file_name, self.closed)
+            self.extracting = False
+        while not self.closed.is_set():
+            self.index.refresh()
+            if self.index.index_some():
+                self.closed.wait(0.5)
+
+    def poll(self):
+        if self.closed.is_set():
+            return
+        self.line_count = self.index.get_line_count()
+        if self.following:
+            self.first_line = self.get_last_first_line()
+        self.check_search_result()
+        self.draw()
+        self.window.after(LogViewer.POLL_MS, self.poll)
+
+    def get_last_first_line(self):
+        return max(0, self.line_count - self.visible_lines)
+
+    def draw(self):
+        state = (self.first_line, self.visible_lines, self.line_count, self.match_line)
+        if state != self.drawn_state:
+            self.drawn_state = state
+            lines = self.index.get_lines(self.first_line, self.visible_lines)
+            self.text.config(state=tk.NORMAL)
+            self.text.delete("1.0", tk.END)
+            self.text.insert("1.0", "\n".join(lines))
+            if self.match_line is not None and self.first_line <= self.match_line < self.first_line + len(lines):
+                text_line = str(self.match_line - self.first_line + 1)
+                self.text.tag_add("match", text_line + ".0", text_line + ".end")
+            self.text.config(state=tk.DISABLED)
+        if self.line_count > 0:
+            self.v_bar.set(self.first_line / self.line_count,
+                           min(1.0, (self.first_line + self.visible_lines) / self.line_count))
+        else:
+            self.v_bar.set(0.0, 1.0)
+        status = "Lines " + str(self.first_line + 1) + "-" + \
+                 str(min(self.line_count, self.first_line + self.visible_lines)) + " of " + str(self.line_count)
+        if self.extracting:
+            status += " (extracting...)"
+        elif not self.index.is_complete():
+            status += " (indexing...)"
+        if self.search_thread is not None:
+            status += " (searching...)"
+        self.status_label.config(text=status)
+
+    def set_first_line(self, first_line):
+        self.first_line = max(0, min(first_line, self.get_last_first_line()))
+        self.draw()
+
+    def scroll_lines(self, num_lines):
+        if num_lines < 0:
+            self.stop_following()
+        self.set_first_line(self.first_line + num_lines)
+
+    def scroll_command(self, *args):
+        """Command of the vertical scrollbar, which scrolls the line window rather than the Text widget"""
+        if args[0] == tk.MOVETO:
+            self.stop_following()
+            self.set_first_line(int(float(args[1]) * self.line_count))
+        elif args[0] == tk.SCROLL:
+            amount = int(args[1])
+            self.scroll_lines(amount * self.visible_lines if args[2] == tk.PAGES else amount)
+
+    def text_configure_callback(self, event):
+        line_space = tkfont.nametofont("TkFixedFont").metrics("linespace")
+        self.visible_lines = max(1, event.height // line_space)
+        self.draw()
+
+    def jump_to_end(self):
+        self.set_first_line(self.get_last_first_line())
+
+    def follow_toggled(self):
+        self.following = bool(self.follow_var.get())
+        if self.following:
+            self.jump_to_end()
+
+    def stop_following(self):
+        self.following = False
+        self.follow_var.set(0)
+
+    def search_text_update_callback(self):
+        """Incremental search: search again shortly after the user stops typing"""
+        if self.pending_search_id is not None:
+            self.window.after_cancel(self.pending_search_id)
+        self.pending_search_id = self.window.after(LogViewer.SEARCH_DELAY_MS, self.incremental_search)
+
+    def incremental_search(self):
+        self.pending_search_id = None
+        if self.compile_search_pattern():
+            self.start_search(self.first_line - 1, False)
+
+    def compile_search_pattern(self):
+        regex = self.search_string_var.get()
+        if regex == "":
+            self.search_pattern = None
+            self.match_line = None
+            self.draw()
+            return False
+        try:
+            self.search_pattern = re.compile(regex.encode('utf-8'), re.MULTILINE)
+            self.search_entry.config(bg='white')
+            return True
+        except re.error:
+            self.search_pattern = None
+            self.search_entry.config(bg='red')
+            return False
+
+    def find_next(self):
+        if self.compile_search_pattern():
+            self.start_search(self.first_line - 1 if self.match_line is None else self.match_line, False)
+
+    def find_previous(self):
+        if self.compile_search_pattern():
+            self.start_search(self.first_line if self.match_line is None else self.match_line, True)
+
+    def start_search(self, from_line, backwards):
+        if self.search_thread is not None:
+            return  # Only one search at a time
+
+        def search(pattern=self.search_pattern):
+            self.search_result = self.index.search(pattern, from_line, backwards)
+
+        self.search_result = None
+        self.search_thread = threading.Thread(name="search " + self.index.file_name, target=search, daemon=True)
+        self.search_thread.start()
+
+    def check_search_result(self):
+        if self.search_thread is None or self.search_thread.is_alive():
+            return
+        self.search_thread = None
+        if self.search_result is None:
+            self.search_entry.config(bg='orange')  # No (more) matches
+            return
+        self.search_entry.config(bg='white')
+        self.match_line = self.search_result
+        self.stop_following()
+        self.first_line = max(0, min(self.match_line - self.visible_lines // 2, self.get_last_first_line()))
+
+    def close(self):
+        self.closed.set()
+        self.window.destroy()
+        self.index_thread.join()
+        self.index.close()
+        if self.archived_output is not None:
+            os.remove(self.index.file_name)
 
 
 class WidgetState(Enum):
@@ -218,9 +2518,14 @@ class GuiProcessWidget:
     """The part of GUI that represents one of the processes
     """
 
-    def __init__(self, master, name, runner, output_file_dir=""):
+    def __init__(self, master, name, runner, output_file_dir="", result_store=None, output_archive=None,
+                 scheduler=None, deleter=None):
         self.name = name
         self.runner = runner
+        self.scheduler = scheduler
+        self.deleter = deleter
+        self.output_archive = output_archive
+        self.result_store = result_store if result_store is not None else ResultStore()
         self.state = WidgetState.INIT
         self.frame = tk.Frame(master, height=self.get_height(), width=self.get_width())
         self.process_enable_var = tk.IntVar()
@@ -228,13 +2533,22 @@ class GuiProcessWidget:
         self.check_button = None
         self.create_check_button()
 
+        self.priority_menu = tk.Menu(self.frame, tearoff=0)
+        self.priority_menu.add_command(label="Run next", command=self.run_next_action)
+        self.priority_menu.add_command(label="Raise priority", command=lambda: self.change_priority_action(1))
+        self.priority_menu.add_command(label="Lower priority", command=lambda: self.change_priority_action(-1))
+        self.frame.bind("<Button-3>", self.show_priority_menu)
+
         self.status_label = None
         self.progress_bar = None
         self.terminate_button = None
         self.open_output_button = None
+        self.view_log_button = None
+        self.shown_progress = None
         if output_file_dir == "":
             output_file_dir = gettempdir()
         self.output_file_name = output_file_dir + "/" + str(uuid.uuid4()) + ".txt"  # UUID is unique
+        self.output_ref = None
 
     def get_tk_widget(self):
         return self.frame
@@ -258,6 +2572,9 @@ class GuiProcessWidget:
     def get_name(self):
         return self.name
 
+    def is_selected(self):
+        return bool(self.process_enable_var.get())
+
     def select(self):
         if self.check_button is not None:
             self.check_button.select()
@@ -275,11 +2592,38 @@ class GuiProcessWidget:
             self.status_label.destroy()
         self.status_label = tk.Label(self.frame, text=text, **kwargs)
         self.status_label.grid(row=0, column=0, sticky=tk.NSEW)
+        self.status_label.bind("<Button-3>", self.show_priority_menu)
+
+    def is_queued(self):
+        return self.state == WidgetState.WAITING and self.scheduler is not None and \
+            self.scheduler.is_queued(self.runner)
+
+    def show_priority_menu(self, event):
+        """Right-click menu to reorder jobs that are still queued"""
+        menu_state = tk.NORMAL if self.is_queued() else tk.DISABLED
+        for i in range(0, 3):
+            self.priority_menu.entryconfig(i, state=menu_state)
+        self.priority_menu.tk_popup(event.x_root, event.y_root)
+
+    def run_next_action(self):
+        if self.is_queued():
+            self.scheduler.run_next(self.runner)
+            self.update_waiting_label()
+
+    def change_priority_action(self, change):
+        if self.is_queued():
+            self.scheduler.reprioritize(self.runner, self.runner.priority + change)
+            self.update_waiting_label()
+
+    def update_waiting_label(self):
+        self.make_status_label(self.name + ": Waiting to start... (priority " + str(self.runner.priority) + ")")
 
     def poll_done(self):
         if self.state == WidgetState.WAITING and self.runner.running:
             self.state = WidgetState.RUNNING
             self.transition_to_running()
+        elif self.state == WidgetState.RUNNING and self.runner.running:
+            self.update_progress()
         elif (self.state == WidgetState.WAITING and self.runner.stop_event.is_set()) \
                 or (self.state == WidgetState.RUNNING and not self.runner.running):
             self.state = WidgetState.DONE
@@ -290,6 +2634,10 @@ class GuiProcessWidget:
         self.terminate_button = tk.Button(self.frame, text="Terminate", command=self.terminate_action)
         self.terminate_button.grid(row=0, column=3, sticky=tk.NE)
 
+    def create_view_log_button(self):
+        self.view_log_button = tk.Button(self.frame, text="View Log", command=self.view_log_action)
+        self.view_log_button.grid(row=0, column=2, sticky=tk.NE)
+
     def create_open_output_button(self):
         self.open_output_button = tk.Button(self.frame, text="Open Output", command=self.open_output_action)
         self.open_output_button.grid(row=0, column=1, sticky=tk.NE)
@@ -297,13 +2645,16 @@ class GuiProcessWidget:
     def transition_to_done(self):
         self.destroy_progress_bar()
         self.destroy_terminate_button()
-        text = self.name + ": " + self.runner.result_message
+        self.destroy_view_log_button()
+        self.write_output_to_file(self.name + ": " + self.runner.result_message + "\n" + self.runner.output)
+        self.runner.release_output()
+        job_result = self.result_store.record_runner(self.runner, self.output_ref)
+        text = self.name + ": " + job_result.get_result_message()
         color = 'black'
-        if "FAIL" in self.runner.result_message:
+        if job_result.status in (JobStatus.FAILED, JobStatus.EXCEPTION):
             color = 'red'
-        if "Success" in self.runner.result_message:
+        if job_result.passed():
             color = '#006400'  # Dark Green
-        self.write_output_to_file(text + "\n" + self.runner.output)
         self.make_status_label(text, fg=color)
         self.create_open_output_button()
 
@@ -312,12 +2663,31 @@ class GuiProcessWidget:
         self.make_status_label(text)
         self.create_and_animate_progress_bar()
         self.create_terminate_button()
+        if self.runner.get_live_output_file_name() is not None:
+            self.create_view_log_button()
 
     def create_and_animate_progress_bar(self):
+        self.shown_progress = None
         self.progress_bar = ttk.Progressbar(self.frame, orient=tk.HORIZONTAL, mode="indeterminate")
         self.progress_bar.grid(row=0, column=1, sticky=tk.NE)
         self.progress_bar.start()
 
+    def update_progress(self):
+        """Switches the progress bar to determinate once the job reports its progress"""
+        progress = self.runner.get_progress()
+        fraction, message = progress
+        if fraction is None or progress == self.shown_progress or self.progress_bar is None:
+            return
+        if self.shown_progress is None:
+            self.progress_bar.stop()
+            self.progress_bar.config(mode="determinate", maximum=100)
+        self.shown_progress = progress
+        self.progress_bar.config(value=100 * fraction)
+        text = self.name + ": Running... " + str(int(100 * fraction)) + "%"
+        if message != "":
+            text += " " + message
+        self.status_label.config(text=text)
+
     def transition_to_not_selected(self):
         self.destroy_status_label()
         self.destroy_progress_bar()
@@ -330,8 +2700,12 @@ class GuiProcessWidget:
         self.destroy_progress_bar()
         self.destroy_terminate_button()
         self.destroy_open_output_button()
-        self.make_status_label(self.name + ": Waiting to start...")
-        self.runner.start()
+        if self.scheduler is not None:
+            self.update_waiting_label()
+            self.scheduler.submit([self.runner])
+        else:
+            self.make_status_label(self.name + ": Waiting to start...")
+            self.runner.start()
 
     def start(self):
         started = False
@@ -348,11 +2722,21 @@ class GuiProcessWidget:
         return started
 
     def write_output_to_file(self, output):
+        if self.output_archive is not None:
+            self.output_ref = self.output_archive.write(self.name, output)
+            return
         with open(self.output_file_name, 'w') as output_file:
             output_file.write(output)
+        self.output_ref = self.output_file_name
 
     def open_output_action(self):
-        webbrowser.open('file://' + self.output_file_name)
+        if isinstance(self.output_ref, ArchivedOutput):
+            LogViewer(self.frame.winfo_toplevel(), None, self.name, archived_output=self.output_ref)
+        else:
+            LogViewer(self.frame.winfo_toplevel(), self.output_file_name, self.name)
+
+    def view_log_action(self):
+        LogViewer(self.frame.winfo_toplevel(), self.runner.get_live_output_file_name(), self.name, follow=True)
 
     def terminate_action(self):
         self.runner.terminate()
@@ -364,11 +2748,17 @@ class GuiProcessWidget:
         self.destroy_status_label()
         self.destroy_progress_bar()
         self.destroy_terminate_button()
+        self.destroy_view_log_button()
         self.destroy_open_output_button()
 
         self.clean_up_files()
         self.create_check_button()
 
+    def destroy_view_log_button(self):
+        if self.view_log_button is not None:
+            self.view_log_button.destroy()
+            self.view_log_button = None
+
     def destroy_open_output_button(self):
         if self.open_output_button is not None:
             self.open_output_button.destroy()
@@ -397,22 +2787,37 @@ class GuiProcessWidget:
 
     def clean_up_files(self):
         if os.path.isfile(self.output_file_name):
-            os.remove(self.output_file_name)
+            if self.deleter is not None:
+                self.deleter.delete(self.output_file_name)
+            else:
+                os.remove(self.output_file_name)
 
 
 class Gui:
     """Main window of the GUI. Contains GuiProcessWidgets.
     """
 
-    def __init__(self, application_title, runners, output_file_dir=""):
+    FILTER_DELAY_MS = 150
+
+    def __init__(self, application_title, runners, output_file_dir="", output_archive=None, duration_history=None,
+                 scheduler=None):
         self.application_title = application_title
+        self.scheduler = scheduler
+        self.deleter = BackgroundDeleter()  # So that reset and exit don't wait on deleting files
+        self.output_archive = output_archive
+        self.duration_history = duration_history if duration_history is not None else DurationHistory()
+        self.eta_estimator = EtaEstimator(self.duration_history)
         self.runners = runners
+        self.run_group = RunGroup()
+        self.active_widgets = list()
+        self.result_store = ResultStore()
 
         self.root = Gui.build_root(application_title)
 
         self.main_frame = Gui.build_main_frame(self.root)
 
         self.filter_text_entry = None  # Forward declare this before registering filter_text_update_callback
+        self.pending_filter_id = None
 
         self.upper_controls_frame, \
             self.select_all_button, \
@@ -431,11 +2836,17 @@ class Gui:
                                                             GuiProcessWidget.get_width(),
                                                             GuiProcessWidget.get_height() * num_procs_to_show,
                                                             runners,
-                                                            output_file_dir)
+                                                            output_file_dir,
+                                                            self.result_store,
+                                                            output_archive,
+                                                            scheduler,
+                                                            self.deleter)
+        self.selection_filter = SelectionFilter.from_runners(runners)
 
         self.lower_controls_frame, \
             self.exit_button, \
-            self.go_button = Gui.build_lower_controls_frame(self.main_frame, self.exit_action, self.go_action)
+            self.go_button, \
+            self.eta_label = Gui.build_lower_controls_frame(self.main_frame, self.exit_action, self.go_action)
         self.reset_button = None
 
         self.root.protocol("WM_DELETE_WINDOW", self.wm_delete_window_action)  # Covers Alt+F4
@@ -475,7 +2886,7 @@ class Gui:
         filter_str.trace("w", lambda name, index, mode, sv=filter_str: filter_callback(sv))
 
         filter_entry = tk.Entry(upr_ctl_frm, textvariable=filter_str)
-        filter_entry.insert(0, "<filter selection (regex)>")
+        filter_entry.insert(0, "<filter selection (regex, tag:NAME, attr:KEY=VALUE)>")
 
         Gui.place_in_expandable_cell(sel_all_btn, 0, 0)
         Gui.place_in_expandable_cell(sel_none_btn, 0, 1)
@@ -485,7 +2896,8 @@ class Gui:
         return upr_ctl_frm, sel_all_btn, sel_none_btn, sel_inv_btn, filter_str, filter_entry
 
     @staticmethod
-    def build_process_canvas(master, canvas_width, canvas_height, runners, output_file_dir):
+    def build_process_canvas(master, canvas_width, canvas_height, runners, output_file_dir, result_store,
+                             output_archive, scheduler, deleter):
         process_canvas = tk.Canvas(master, width=canvas_width, height=canvas_height)
 
         h_bar = tk.Scrollbar(master, orient=tk.HORIZONTAL, command=process_canvas.xview)
@@ -503,7 +2915,8 @@ class Gui:
         canvas_height = 0
         process_widgets = list()
         for i, r in enumerate(runners):
-            pw = GuiProcessWidget(process_canvas, r.name, r, output_file_dir)
+            pw = GuiProcessWidget(process_canvas, r.name, r, output_file_dir, result_store, output_archive, scheduler,
+                                  deleter)
             process_widgets.append(pw)
             pos_x = 0
             pos_y = pw.get_height() * i
@@ -529,7 +2942,10 @@ class Gui:
 
         go_button = Gui.build_go_button(lower_controls_frame, go_action)
 
-        return lower_controls_frame, exit_button, go_button
+        eta_label = tk.Label(lower_controls_frame, text="")
+        eta_label.grid(row=1, column=0, columnspan=2, sticky=tk.NSEW)
+
+        return lower_controls_frame, exit_button, go_button, eta_label
 
     @staticmethod
     def build_go_button(master, go_action):
@@ -573,21 +2989,37 @@ class Gui:
             p.toggle()
 
     def filter_text_update_callback(self, sv):
-        regex = sv.get()
+        """Called on every keystroke, so only (re)schedule the filter to be applied once typing pauses"""
+        if self.filter_text_entry is None:
+            return  # Still being constructed. Don't apply the placeholder text.
+        if self.pending_filter_id is not None:
+            self.root.after_cancel(self.pending_filter_id)
+        self.pending_filter_id = self.root.after(Gui.FILTER_DELAY_MS, lambda: self.apply_filter(sv.get()))
+
+    def apply_filter(self, filter_string):
+        self.pending_filter_id = None
         try:
-            pattern = re.compile(regex)
-            if self.filter_text_entry is not None:
-                self.filter_text_entry.config(bg='white')
-            for p in self.process_widgets:
-                if pattern.search(p.get_name()):
+            selected = self.selection_filter.get_selected(filter_string)
+        except re.error:
+            self.filter_text_entry.config(bg='red')
+            return
+        self.filter_text_entry.config(bg='white')
+        for i, p in enumerate(self.process_widgets):
+            should_be_selected = i in selected
+            if should_be_selected != p.is_selected():
+                if should_be_selected:
                     p.select()
                 else:
                     p.deselect()
-        except Exception:
-            if self.filter_text_entry is not None:
-                self.filter_text_entry.config(bg='red')
+
+    def stop_scheduler(self):
+        """Stop starting queued runners, e.g. as terminating running ones frees their slots"""
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler.clear()
 
     def exit_action(self):
+        self.stop_scheduler()
         for p in self.process_widgets:
             p.terminate_action()
         self.clean_up_files()
@@ -595,12 +3027,16 @@ class Gui:
 
     def go_action(self):
         self.go_button.config(state=tk.DISABLED)
-        num_started = 0
+        self.run_group.close()
+        self.run_group = RunGroup([p.runner for p in self.process_widgets if p.is_selected()])
+        self.active_widgets = list()
         for p in self.process_widgets:
             if p.start():
-                num_started += 1
+                self.active_widgets.append(p)
+        if self.scheduler is not None:
+            self.scheduler.start()
 
-        if num_started > 0:
+        if len(self.active_widgets) > 0:
             self.root.after(250, self.process_widget_polling_loop)
         else:
             self.change_go_button_to_reset_button()
@@ -609,16 +3045,21 @@ class Gui:
         if self.poll_all_widgets_done():
             self.all_widgets_done_action()
         else:
+            self.update_eta_label()
             self.root.after(250, self.process_widget_polling_loop)
 
+    def update_eta_label(self):
+        parallelism = None if self.scheduler is None else self.scheduler.max_workers
+        remaining = self.eta_estimator.estimate_remaining(self.run_group.runners, parallelism)
+        self.eta_label.config(text="ETA: " + EtaEstimator.format_duration(remaining))
+
     def poll_all_widgets_done(self):
-        all_done = True  # Starts True because of the 'and' in the loop
-        for i, p in enumerate(self.process_widgets):
-            d = p.poll_done()
-            all_done = all_done and d
-        return all_done
+        """Only the widgets that are not done yet are polled"""
+        self.active_widgets = [p for p in self.active_widgets if not p.poll_done()]
+        return len(self.active_widgets) == 0 and self.run_group.wait_all(0)
 
     def reset_action(self):
+        self.result_store.clear()
         for p in self.process_widgets:
             p.reset()
         self.reset_button.destroy()
@@ -626,6 +3067,11 @@ class Gui:
         self.go_button = Gui.build_go_button(self.lower_controls_frame, self.go_action)
 
     def all_widgets_done_action(self):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        self.eta_label.config(text="")
+        self.duration_history.record_results(self.result_store)
+        self.duration_history.save()
         if self.go_button is not None:
             self.change_go_button_to_reset_button()
 
@@ -638,6 +3084,7 @@ class Gui:
         self.root.mainloop()
 
     def keyboard_exit_key_combination(self, event):
+        self.stop_scheduler()
         self.clean_up_files()
         self.root.destroy()
 
@@ -661,12 +3108,254 @@ class Gui:
     def clean_up_files(self):
         for p in self.process_widgets:
             p.clean_up_files()
+        if self.output_archive is not None:
+            self.output_archive.close()
+
+
+class DaemonOutputStream:
+    """Replaces sys.stdout in a daemon worker: sends what is written to the client as JSON-line output messages.
+    Once the client has gone away, the output is dropped and on_disconnect is called (once)."""
+
+    def __init__(self, connection, on_disconnect=None):
+        self.connection = connection
+        self.on_disconnect = on_disconnect
+        self.disconnected = False
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        sent = True
+        if len(text) > 0:
+            with self.lock:
+                if not self.disconnected:
+                    try:
+                        self.connection.sendall(RunnerDaemon.encode_message(output=text))
+                    except OSError:
+                        sent = False
+        if not sent:
+            self.disconnect()
+        return len(text)
+
+    def disconnect(self):
+        with self.lock:
+            if self.disconnected:
+                return
+            self.disconnected = True
+            on_disconnect = self.on_disconnect
+        if on_disconnect is not None:
+            on_disconnect()
+
+    def watch(self):
+        """Waits for the client to close the connection (it sends nothing after its request), then disconnects"""
+        try:
+            while len(self.connection.recv(4096)) > 0:
+                pass
+        except OSError:
+            pass
+        self.disconnect()
+
+    def flush(self):
+        pass
+
+
+class RunnerDaemon:
+    """Keeps the runner catalog of an app warm, so that a run of a few runners does not pay for starting Python,
+    importing modules and get_runners() every time.
+
+    The daemon listens on a Unix domain socket and keeps a pool of pre-forked workers, each of which inherits the
+    catalog and accepts one connection. A client (see DaemonClient) sends a JSON line {"select": REGEX}; the worker
+    runs the matching runners with the CLI, streaming its output back as {"output": TEXT} lines followed by
+    {"exit": CODE}, then exits and is replaced by a fresh fork. When one of the app's watched files changes, the
+    daemon re-executes itself (keeping the socket) to rebuild the catalog."""
+
+    LISTEN_FD_ENV = "PARALLEL_PROC_RUNNER_DAEMON_FD"
+
+    def __init__(self, app, socket_path, num_workers=2, poll_interval=0.5):
+        self.app = app
+        self.socket_path = socket_path
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.workers = set()
+        self.watched_mtimes = dict()
+        self.stopping = threading.Event()
+        self.listener = self.open_listener()
+
+    def open_listener(self):
+        listen_fd = os.environ.pop(RunnerDaemon.LISTEN_FD_ENV, None)
+        if listen_fd is not None:
+            # Re-executed after a watched file changed: keep listening on the same socket
+            return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, fileno=int(listen_fd))
+        if os.path.exists(self.socket_path):
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                    probe.connect(self.socket_path)
+                raise IOError("A daemon is already listening on " + self.socket_path)
+            except ConnectionRefusedError:
+                os.remove(self.socket_path)  # Left behind by a daemon that died
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(16)
+        return listener
+
+    @staticmethod
+    def encode_message(**message):
+        return (json.dumps(message) + "\n").encode("utf-8")
+
+    @staticmethod
+    def get_mtimes(file_names):
+        mtimes = dict()
+        for file_name in file_names:
+            try:
+                mtimes[file_name] = os.stat(file_name).st_mtime_ns
+            except OSError:
+                mtimes[file_name] = None
+        return mtimes
+
+    def load_catalog(self):
+        self.watched_mtimes = RunnerDaemon.get_mtimes(self.app.get_watched_files())
+        self.app.catalog = list(self.app.get_runners())
+
+    def catalog_is_stale(self):
+        return RunnerDaemon.get_mtimes(self.watched_mtimes.keys()) != self.watched_mtimes
+
+    def serve_forever(self):
+        self.load_catalog()
+        print("Serving", len(self.app.catalog), "runners on", self.socket_path)
+        try:
+            while not self.stopping.is_set():
+                self.reap_workers()
+                if self.catalog_is_stale():
+                    print("Watched files changed, reloading")
+                    self.reload()
+                while len(self.workers) < self.num_workers:
+                    self.fork_worker()
+                self.stopping.wait(self.poll_interval)
+        finally:
+            self.stop_workers()
+            self.listener.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def stop(self):
+        self.stopping.set()
+
+    def reap_workers(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.workers.discard(pid)
+
+    def stop_workers(self):
+        """Idle workers die on SIGTERM; busy ones ignore it and finish serving their client"""
+        self.stop_workers_that_are_idle()
+        for pid in self.workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.workers.clear()
+
+    def reload(self):
+        """Re-execute the daemon, keeping the listening socket, so that changed modules are imported again"""
+        self.stop_workers_that_are_idle()
+        self.workers.clear()  # Busy workers are reaped by the re-executed daemon, which is still their parent
+        os.set_inheritable(self.listener.fileno(), True)
+        os.environ[RunnerDaemon.LISTEN_FD_ENV] = str(self.listener.fileno())
+        sys.stdout.flush()
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def stop_workers_that_are_idle(self):
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def fork_worker(self):
+        pid = os.fork()
+        if pid != 0:
+            self.workers.add(pid)
+            return
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            self.serve_one()
+        finally:
+            os._exit(0)
+
+    def serve_one(self):
+        connection, address = self.listener.accept()
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        self.listener.close()
+        with connection:
+            exit_code = 1
+            stream = DaemonOutputStream(connection, self.client_disconnected)
+            sys.stdout = sys.stderr = stream
+            try:
+                request = json.loads(connection.makefile("r", encoding="utf-8").readline())
+                threading.Thread(target=stream.watch, daemon=True).start()
+                self.app.options.select = request.get("select")
+                self.app.run_selected_runners()
+                exit_code = 0
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+            except Exception as e:
+                print(type(e).__name__ + ": " + str(e))
+            stream.on_disconnect = None  # The run is over, nothing left to abandon
+            try:
+                connection.sendall(RunnerDaemon.encode_message(exit=exit_code))
+            except OSError:
+                pass  # The client has gone away
+        for t in threading.enumerate():
+            if t is not threading.current_thread() and not t.daemon:
+                t.join()  # e.g. a BackgroundDeleter still removing scratch directories
+
+    def client_disconnected(self):
+        """Called (e.g. from a runner's stop callback) when the client of this worker has gone away: nobody is left to
+        see the results, so the running jobs are terminated and the worker exits, to be replaced by a fresh fork"""
+        threading.Thread(target=self.abandon_run, daemon=True).start()
+
+    def abandon_run(self):
+        running = [r for r in self.app.catalog if r.running]
+        for r in running:
+            r.terminate()
+        ParallelProcRunnerAppBase.wait_for_started_runners(running)
+        os._exit(1)
+
+
+class DaemonClient:
+    """Thin client for a RunnerDaemon: submits a selection regex and streams back the output and the exit code"""
+
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def run(self, select=None, out=None):
+        if out is None:
+            out = sys.stdout
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(self.timeout)
+            connection.connect(self.socket_path)
+            connection.sendall(RunnerDaemon.encode_message(select=select))
+            for line in connection.makefile("r", encoding="utf-8"):
+                message = json.loads(line)
+                if "output" in message:
+                    out.write(message["output"])
+                    out.flush()
+                elif "exit" in message:
+                    return message["exit"]
+        raise ConnectionError("The daemon closed the connection before the run finished")
 
 
 class ParallelProcRunnerAppBase:
     """A base class for the Parallel Process Runner app.
     Selects between the GUI or CLI."""
 
+    EXIT_WAIT_SECONDS = 5.0  # For runners that are still finishing when the interface exits
+    BENCHMARK_ORDER = (False, True, True, False)  # Placement off/on for each run of --benchmark-placement
+
     def __init__(self, name, usage=None, output_file_dir=""):
         self.name = name
         self.output_file_dir = output_file_dir
@@ -674,6 +3363,54 @@ class ParallelProcRunnerAppBase:
         self.configure_default_options(self.opt_parser)
         self.configure_custom_options(self.opt_parser)
         (self.options, self.args) = self.opt_parser.parse_args()
+        self.catalog = None  # Runners kept warm by a RunnerDaemon
+        if self.options.select is not None:
+            try:
+                re.compile(self.options.select)
+            except re.error as e:
+                self.opt_parser.error("--select: " + str(e))
+        if self.options.daemon_socket is not None:
+            self.options.gui = False
+        self.shard = None
+        if self.options.shard is not None:
+            try:
+                self.shard = RunnerSharder.parse_shard_option(self.options.shard)
+            except ValueError as e:
+                self.opt_parser.error("--shard: " + str(e))
+        if self.options.jobs is not None and self.options.jobs < 1:
+            self.opt_parser.error("--jobs must be at least 1")
+        self.priorities = self.parse_regex_assignments("--priority", self.options.priorities)
+        self.cpu_requests = self.parse_regex_assignments("--cpus", self.options.cpu_requests)
+        if self.options.benchmark_placement and self.options.gui:
+            self.opt_parser.error("--benchmark-placement requires --cli")
+        if self.options.batch:
+            # Batched runners don't go through the PriorityScheduler, so they can't be placed on CPUs, and the -j
+            # limit applies to their worker threads instead
+            if self.options.cpu_placement or self.options.benchmark_placement:
+                self.opt_parser.error("--batch can't be combined with CPU placement")
+            if self.options.jobs is not None:
+                if self.options.batch_workers is None:
+                    self.options.batch_workers = self.options.jobs
+                elif self.options.batch_workers > self.options.jobs:
+                    self.opt_parser.error("--batch-workers can't be more than --jobs")
+        if self.options.resume_file is not None:
+            if self.options.gui:
+                self.opt_parser.error("--resume requires --cli")
+            if not os.path.isfile(self.options.resume_file):
+                self.opt_parser.error("--resume: no such journal: " + self.options.resume_file)
+            if self.options.journal_file is None:
+                self.options.journal_file = self.options.resume_file
+
+    def parse_regex_assignments(self, option_name, option_values):
+        """Parses the REGEX=N values of an option into a list of (compiled regex, N)"""
+        assignments = list()
+        for option_value in option_values:
+            regex, separator, number_text = option_value.rpartition("=")
+            try:
+                assignments.append((re.compile(regex), int(number_text)))
+            except (re.error, ValueError):
+                self.opt_parser.error(option_name + ": expected REGEX=N, got " + repr(option_value))
+        return assignments
 
     def configure_default_options(self, parser):
         parser.add_option("-c", "--cli", dest='gui', action='store_false',
@@ -682,6 +3419,108 @@ class ParallelProcRunnerAppBase:
         parser.add_option("-g", "--gui", dest='gui', action='store_true', default=True,
                           help="use the GUI (graphical-user-interface), not the CLI")
 
+        parser.add_option("--output-archive", dest='output_archive_dir', metavar="DIR", default=None,
+                          help="write the output of all jobs, compressed, into a new run directory under DIR "
+                               "instead of one temporary file per job")
+
+        parser.add_option("--duration-history", dest='duration_history_file', metavar="FILE", default=None,
+                          help="remember job durations in FILE, to estimate how long a run will take and to "
+                               "balance shards (with --shard, FILE is only read, and every executor must be given "
+                               "the same FILE)")
+
+        parser.add_option("--shard", dest='shard', metavar="INDEX/COUNT", default=None,
+                          help="only run shard INDEX (from 0 to COUNT-1) of the runners split into COUNT shards of "
+                               "about the same duration, e.g. to split a suite across CI executors. Executors must "
+                               "share the same, read-only --duration-history so that they compute the same shards.")
+
+        parser.add_option("--fatal-pattern", dest='fatal_patterns', metavar="REGEX", action='append', default=[],
+                          help="fail a job whose output matches REGEX (may be given more than once)")
+
+        parser.add_option("--error-pattern", dest='error_patterns', metavar="REGEX", action='append', default=[],
+                          help="fail a job whose output matches REGEX, and count the matches as errors")
+
+        parser.add_option("--warning-pattern", dest='warning_patterns', metavar="REGEX", action='append', default=[],
+                          help="count the lines of output that match REGEX as warnings")
+
+        parser.add_option("--kill-on-fatal", dest='kill_on_fatal', action='store_true', default=False,
+                          help="terminate() a job as soon as its output matches a --fatal-pattern (for jobs that "
+                               "emit their output as it arrives)")
+
+        parser.add_option("--journal", dest='journal_file', metavar="FILE", default=None,
+                          help="CLI only: record the start and finish of every job in FILE, so that the run can be "
+                               "resumed with --resume if it is interrupted")
+
+        parser.add_option("--resume", dest='resume_file', metavar="FILE", default=None,
+                          help="CLI only: resume the run recorded in the journal FILE, only running the jobs that "
+                               "did not finish (implies --journal FILE)")
+
+        parser.add_option("--metrics-port", dest='metrics_port', metavar="PORT", type='int', default=None,
+                          help="serve live metrics of the run in the Prometheus text format on "
+                               "http://127.0.0.1:PORT/metrics")
+
+        parser.add_option("--metrics-file", dest='metrics_file', metavar="FILE", default=None,
+                          help="periodically write a snapshot of the live metrics of the run to FILE")
+
+        parser.add_option("--trace", dest='trace_file', metavar="PATH", default=None,
+                          help="write a timeline of the run to PATH as Chrome trace-event JSON, for Perfetto or "
+                               "chrome://tracing")
+
+        parser.add_option("-j", "--jobs", dest='jobs', metavar="N", type='int', default=None,
+                          help="run at most N jobs at a time (default: no limit)")
+
+        parser.add_option("--priority", dest='priorities', metavar="REGEX=N", action='append', default=[],
+                          help="give the runners whose name matches REGEX priority N (default 0; higher runs "
+                               "first). May be given more than once; the last match wins.")
+
+        parser.add_option("--cpu-placement", dest='cpu_placement', action='store_true', default=False,
+                          help="bind each job to its own CPUs, packed onto one NUMA node, and only start a job when "
+                               "enough CPUs are free")
+
+        parser.add_option("--cpus", dest='cpu_requests', metavar="REGEX=N", action='append', default=[],
+                          help="with --cpu-placement, give the runners whose name matches REGEX N CPUs (default 1). "
+                               "May be given more than once; the last match wins.")
+
+        parser.add_option("--benchmark-placement", dest='benchmark_placement', action='store_true', default=False,
+                          help="CLI only: run the jobs several times with --cpu-placement off and on, at the same "
+                               "concurrency (-j, or the number of CPUs), and compare the throughput")
+
+        parser.add_option("--scratch", dest='scratch', action='store_true', default=False,
+                          help="give each job its own scratch directory (in its setup_kwargs['scratch_dir']), on "
+                               "tmpfs if available")
+
+        parser.add_option("--scratch-dir", dest='scratch_dir', metavar="DIR", default=None,
+                          help="create the scratch directories under DIR (implies --scratch)")
+
+        parser.add_option("--scratch-min-free", dest='scratch_min_free_mb', metavar="MB", type='int', default=0,
+                          help="only create scratch directories where at least MB megabytes are free")
+
+        parser.add_option("--keep-failed-scratch", dest='keep_failed_scratch', action='store_true', default=False,
+                          help="keep the scratch directories of failing jobs")
+
+        parser.add_option("--batch", dest='batch', action='store_true', default=False,
+                          help="CLI only: run lightweight runners in batches on a few worker threads")
+
+        parser.add_option("--batch-workers", dest='batch_workers', metavar="N", type='int', default=None,
+                          help="number of worker threads for --batch, at most --jobs (default: --jobs if given, "
+                               "else the number of CPUs). --batch can't be combined with --cpu-placement.")
+
+        parser.add_option("--select", dest='select', metavar="REGEX", default=None,
+                          help="only run the runners whose name matches REGEX, and the runners they are gated on")
+
+        parser.add_option("--daemon", dest='daemon_socket', metavar="SOCKET", default=None,
+                          help="keep the runners loaded in a daemon listening on the Unix domain socket SOCKET, and "
+                               "run them with the CLI for each --client (the other options apply to every run)")
+
+        parser.add_option("--daemon-workers", dest='daemon_workers', metavar="N", type='int', default=2,
+                          help="number of pre-forked workers for --daemon, i.e. clients served at once (default: 2)")
+
+        parser.add_option("--watch", dest='watch_files', metavar="FILE", action='append', default=[],
+                          help="reload the --daemon when FILE changes (may be given more than once; the app's own "
+                               "modules are always watched)")
+
+        parser.add_option("--client", dest='client_socket', metavar="SOCKET", default=None,
+                          help="run the runners selected by --select in the --daemon listening on SOCKET")
+
     def configure_custom_options(self, parser):
         """Child may extend this"""
         pass
@@ -690,12 +3529,183 @@ class ParallelProcRunnerAppBase:
         """Child must implement to return an iterable containing objects that inherit from BaseJobRunner"""
         return list()
 
+    def get_watched_files(self):
+        """Files that invalidate the runners of a --daemon when they change. Child may extend this with the inputs
+        of get_runners()."""
+        watched_files = list(self.options.watch_files)
+        for module_name in {type(self).__module__, __name__}:
+            module_file = getattr(sys.modules.get(module_name), "__file__", None)
+            if module_file is not None:
+                watched_files.append(os.path.abspath(module_file))
+        return watched_files
+
+    def create_output_archive(self):
+        if self.options.output_archive_dir is None:
+            return None
+        return OutputArchive(OutputArchive.create_run_dir_name(self.options.output_archive_dir))
+
+    def get_output_classifier(self):
+        """Child may extend this to add its own patterns (e.g. for the messages of a particular simulator)"""
+        classifier = OutputClassifier(terminate_on_fatal=self.options.kill_on_fatal)
+        try:
+            for severity, regexes in [(Severity.FATAL, self.options.fatal_patterns),
+                                      (Severity.ERROR, self.options.error_patterns),
+                                      (Severity.WARNING, self.options.warning_patterns)]:
+                for regex in regexes:
+                    classifier.add_pattern(severity, regex)
+        except re.error as e:
+            self.opt_parser.error("invalid output pattern: " + str(e))
+        return classifier
+
+    def get_selected_runners(self, duration_history):
+        """The runners from get_runners() that this invocation should run"""
+        runners = list(self.catalog) if self.catalog is not None else self.get_runners()
+        if self.options.select is not None:
+            pattern = re.compile(self.options.select)
+            runners = list(runners)
+            runners = RunnerSharder.add_gating_runners(runners, [r for r in runners if pattern.search(r.name)])
+        for r in runners:
+            for pattern, priority in self.priorities:
+                if pattern.search(r.name):
+                    r.set_priority(priority)
+            for pattern, num_cpus in self.cpu_requests:
+                if pattern.search(r.name):
+                    r.set_num_cpus(num_cpus)
+        classifier = self.get_output_classifier()
+        if not classifier.is_empty():
+            for r in runners:
+                if r.output_classifier is None:
+                    r.set_output_classifier(classifier)
+        if self.shard is not None:
+            index, count = self.shard
+            all_runners = list(runners)
+            runners = RunnerSharder.shard(all_runners, index, count, duration_history)
+            print("Shard", str(index) + "/" + str(count) + ":", len(runners), "of", len(all_runners), "runners")
+        return runners
+
+    def create_metrics_exporter(self, runners):
+        if self.options.metrics_port is None and self.options.metrics_file is None:
+            return None
+        metrics = RunMetrics()
+        for r in runners:
+            r.add_observer(metrics)
+        metrics_exporter = MetricsExporter(metrics, self.options.metrics_port, self.options.metrics_file)
+        metrics_exporter.start()
+        return metrics_exporter
+
+    def create_trace_writer(self, runners):
+        if self.options.trace_file is None:
+            return None
+        trace_writer = TraceWriter(self.options.trace_file)
+        for r in runners:
+            r.add_observer(trace_writer)
+        return trace_writer
+
+    def create_scratch_manager(self, runners):
+        if not self.options.scratch and self.options.scratch_dir is None:
+            return None
+        scratch_manager = ScratchManager(self.options.scratch_dir, self.options.scratch_min_free_mb * 1024 * 1024,
+                                         self.options.keep_failed_scratch)
+        for r in runners:
+            r.set_scratch_manager(scratch_manager)
+        return scratch_manager
+
     def run(self):
+        if self.options.client_socket is not None:
+            try:
+                sys.exit(DaemonClient(self.options.client_socket).run(self.options.select))
+            except OSError as e:
+                sys.exit("--client: " + str(e))
+        if self.options.daemon_socket is not None:
+            daemon = RunnerDaemon(self, self.options.daemon_socket, self.options.daemon_workers)
+            try:
+                daemon.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            return
+        self.run_selected_runners()
+
+    def run_selected_runners(self):
+        output_archive = self.create_output_archive()
+        # Each executor of a sharded run must compute the same shards, so none of them may update the history
+        duration_history = DurationHistory(self.options.duration_history_file, read_only=self.shard is not None)
+        runners = self.get_selected_runners(duration_history)
+        metrics_exporter = self.create_metrics_exporter(runners)
+        trace_writer = self.create_trace_writer(runners)
+        scratch_manager = self.create_scratch_manager(runners)
+        try:
+            self.run_interface(runners, output_archive, duration_history)
+        finally:
+            if metrics_exporter is not None or trace_writer is not None or scratch_manager is not None:
+                ParallelProcRunnerAppBase.wait_for_started_runners(runners)
+            if scratch_manager is not None:
+                scratch_manager.close()
+            if metrics_exporter is not None:
+                metrics_exporter.stop()
+            if trace_writer is not None:
+                trace_writer.close()
+
+    @staticmethod
+    def wait_for_started_runners(runners, timeout=EXIT_WAIT_SECONDS):
+        """Gives the runners that are still finishing (e.g. terminated when the GUI exits) a chance to reach their
+        observers and release their scratch directories, so that the final metrics and the trace include them, and
+        the scratch space isn't removed from under them"""
+        deadline = time() + timeout
+        for r in runners:
+            if r.start_time is not None and not r.stop_event.wait(max(0.0, deadline - time())):
+                return
+
+    def create_cpu_placement(self, bind=True):
+        topology = NumaTopology.read()
+        print("CPU placement on", topology)
+        return CpuPlacement(topology, bind)
+
+    def benchmark_placement(self, runners):
+        """Runs the jobs with CPU placement off and on, in the order of BENCHMARK_ORDER so that neither always runs
+        first on cold caches, and compares the average throughput. Both use the same -j limit (the number of CPUs by
+        default) and the same CPU accounting, so only the binding differs."""
+        num_jobs = self.options.jobs if self.options.jobs is not None else NumaTopology.read().get_num_cpus()
+        timings = {False: list(), True: list()}
+        exit_code = 0
+        for bind in ParallelProcRunnerAppBase.BENCHMARK_ORDER:
+            scheduler = PriorityScheduler(num_jobs, self.create_cpu_placement(bind))
+            start_time = time()
+            try:
+                Cli(runners, self.output_file_dir, scheduler=scheduler).run()
+            except SystemExit as e:
+                exit_code = max(exit_code, e.code if isinstance(e.code, int) else 1)
+            timings[bind].append(time() - start_time)
+        print()
+        average = {bind: sum(durations) / len(durations) for bind, durations in timings.items()}
+        for bind, label in [(False, "off"), (True, "on")]:
+            print("Placement {}: {:.2f} s average of {} runs, {:.3f} jobs/s".format(
+                label, average[bind], len(timings[bind]), len(runners) / max(average[bind], 1e-9)))
+        print("Speedup with placement: {:.2f}x (at most {} jobs at a time)".format(
+            average[False] / max(average[True], 1e-9), num_jobs))
+        sys.exit(exit_code)
+
+    def run_interface(self, runners, output_archive, duration_history):
+        if self.options.benchmark_placement:
+            self.benchmark_placement(runners)
+        scheduler = None
+        if self.options.jobs is not None or len(self.priorities) > 0 or self.options.cpu_placement:
+            placement = self.create_cpu_placement() if self.options.cpu_placement else None
+            scheduler = PriorityScheduler(self.options.jobs, placement)
         if self.options.gui:
-            gui = Gui(self.name, self.get_runners(), self.output_file_dir)
+            gui = Gui(self.name, runners, self.output_file_dir, output_archive, duration_history, scheduler)
             gui.run()
         else:
-            cli = Cli(self.get_runners())
+            batch_dispatcher = None
+            if self.options.batch:
+                batch_dispatcher = BatchDispatcher(self.options.batch_workers, duration_history, scheduler)
+            resumed_results = None
+            if self.options.resume_file is not None:
+                resumed_results = RunJournal.load_results(self.options.resume_file)
+            journal = None
+            if self.options.journal_file is not None:
+                journal = RunJournal(self.options.journal_file)
+            cli = Cli(runners, self.output_file_dir, output_archive, duration_history, batch_dispatcher, journal,
+                      resumed_results, scheduler)
             cli.run()
 
 
@@ -22,8 +22,24 @@
 
 import unittest
 import threading
+import tempfile
+import os
+import re
+import io
+import contextlib
+import urllib.request
+import json
+import unittest.mock
+import sys
+import socket
 from time import sleep
-from parallel_proc_runner_base import DummyRunner
+from collections import OrderedDict
+from parallel_proc_runner_base import DummyRunner, JobStatus, JobResult, ResultStore, OutputArchive, ArchivedOutput, \
+    LogFileIndex, SelectionFilter, DurationHistory, EtaEstimator, \
+    RunnerSharder, BatchDispatcher, OutputClassifier, Severity, RunJournal, Cli, \
+    RunMetrics, MetricsExporter, TraceWriter, RunGroup, \
+    PriorityScheduler, ScratchManager, BackgroundDeleter, RunnerDaemon, DaemonClient, DaemonOutputStream, \
+    NumaTopology, CpuPlacement, ParallelProcRunnerAppBase, BaseJobRunner, RunObserver
 
 
 class BaseRunnerTest(unittest.TestCase):
@@ -260,6 +276,1119 @@ class BaseRunnerTest(unittest.TestCase):
         self.assertEqual("\nTypeError: must be str, not NoneType", self.stop_callback_output)
         self.assertFalse(self.runner.running)
 
+    def test_that_status_and_times_are_recorded(self):
+        self.runner.set_args(job_mocking_event=self.job_mocking_event)
+        self.runner.set_result(3)
+        self.job_mocking_event.set()
+        self.runner.run()
+        self.assertEqual(JobStatus.FAILED, self.runner.status)
+        self.assertIsNotNone(self.runner.start_time)
+        self.assertGreaterEqual(self.runner.stop_time, self.runner.start_time)
+        job_result = JobResult.from_runner(self.runner)
+        self.assertEqual("FAIL (3)", job_result.get_result_message())
+        self.assertEqual(3, job_result.return_code)
+
+    def test_that_progress_reports_are_coalesced_and_rate_limited(self):
+        calls = list()
+        self.runner.set_progress_callback(lambda name, fraction, message: calls.append((fraction, message)))
+        self.runner.report_progress(0.1, "a")
+        self.runner.report_progress(0.2, "b")
+        self.runner.report_progress(1.5, "c")
+        self.assertEqual([(0.1, "a")], calls)
+        self.assertEqual((1.0, "c"), self.runner.get_progress())
+        self.runner.flush_progress()
+        self.assertEqual([(0.1, "a"), (1.0, "c")], calls)
+
+    def test_that_the_latest_held_back_report_is_delivered_at_the_end_of_the_interval(self):
+        calls = list()
+        delivered = threading.Event()
+        self.runner.set_progress_callback(lambda name, fraction, message: (calls.append(fraction), delivered.set()))
+        with unittest.mock.patch.object(BaseJobRunner, 'PROGRESS_CALLBACK_INTERVAL', 0.05):
+            self.runner.report_progress(0.1)
+            delivered.clear()
+            self.runner.report_progress(0.5)
+            self.runner.report_progress(1.0)
+            self.assertTrue(delivered.wait(5))
+        self.assertEqual([0.1, 1.0], calls)
+
+    def test_that_no_timer_is_armed_without_a_progress_callback(self):
+        for fraction in [0.1, 0.2, 0.3]:
+            self.runner.report_progress(fraction)
+        self.assertIsNone(self.runner.progress_timer)
+        self.assertEqual((0.3, ""), self.runner.get_progress())
+
+
+class ResultStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = ResultStore()
+        self.store.add(JobResult("fast pass", JobStatus.PASSED, 0, 10.0, 11.0))
+        self.store.add(JobResult("slow fail", JobStatus.FAILED, 2, 10.0, 20.0))
+        self.store.add(JobResult("medium exception", JobStatus.EXCEPTION, -1, 10.0, 15.0))
+
+    def test_that_records_have_no_dict(self):
+        self.assertFalse(hasattr(self.store.get("fast pass"), '__dict__'))
+
+    def test_failing(self):
+        self.assertEqual(["slow fail", "medium exception"], [r.name for r in self.store.failing()])
+
+    def test_slowest(self):
+        self.assertEqual(["slow fail", "medium exception"], [r.name for r in self.store.slowest(2)])
+
+    def test_matching(self):
+        self.assertEqual(["fast pass", "slow fail"], [r.name for r in self.store.matching(r"^(fast|slow)")])
+
+    def test_clear(self):
+        self.store.clear()
+        self.assertEqual(0, len(self.store))
+        self.assertIsNone(self.store.get("slow fail"))
+
+
+class OutputArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.archive = OutputArchive(self.temp_dir.name + "/run")
+
+    def tearDown(self):
+        self.archive.close()
+        self.temp_dir.cleanup()
+
+    def test_that_each_job_can_be_read_back(self):
+        self.archive.write("a", "output of a\n" * 100)
+        self.archive.write("b", "output of b")
+        self.assertEqual("output of b", self.archive.read("b"))
+        self.assertEqual("output of a\n" * 100, self.archive.read("a"))
+        self.assertEqual("", self.archive.read("c"))
+
+    def test_that_job_result_reads_archived_output(self):
+        entry = self.archive.write("a", "archived")
+        self.assertEqual("archived", JobResult("a", JobStatus.PASSED, 0, output_file=entry).read_output())
+
+    def test_that_index_is_loaded_when_reopened(self):
+        self.archive.write("a", "first")
+        self.archive.write("b", "second")
+        self.archive.close()
+        self.archive = OutputArchive(self.temp_dir.name + "/run")
+        self.assertEqual(["a", "b"], self.archive.get_names())
+        self.assertEqual("second", self.archive.read("b"))
+
+    def test_that_an_entry_is_extracted_a_chunk_at_a_time(self):
+        self.archive.write("a", "before")
+        output = "".join("line " + str(i) + "\n" for i in range(0, 200000))
+        entry = self.archive.write("b", output)
+        self.archive.write("c", "after")
+        file_name = self.temp_dir.name + "/b.txt"
+        with unittest.mock.patch.object(ArchivedOutput, 'EXTRACT_CHUNK_SIZE', 4096):
+            entry.extract(file_name)
+        with open(file_name) as extracted_file:
+            self.assertEqual(output, extracted_file.read())
+        stop_event = threading.Event()
+        stop_event.set()
+        entry.extract(file_name, stop_event)
+        self.assertEqual(0, os.path.getsize(file_name))
+
+
+class LogFileIndexTest(unittest.TestCase):
+    live = False
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_name = self.temp_dir.name + "/log.txt"
+        with open(self.file_name, 'w') as log_file:
+            log_file.write("".join("line " + str(i) + "\n" for i in range(1000)))
+        self.index = LogFileIndex(self.file_name, live=self.live)
+        self.index.refresh()
+        while not self.index.index_some(max_bytes=100):
+            pass
+
+    def tearDown(self):
+        self.index.close()
+        self.temp_dir.cleanup()
+
+    def test_line_window(self):
+        self.assertEqual(1000, self.index.get_line_count())
+        self.assertEqual(["line 500", "line 501"], self.index.get_lines(500, 2))
+        self.assertEqual(["line 999"], self.index.get_lines(999, 10))
+
+    def test_search(self):
+        pattern = re.compile(rb"^line 9\d\d$", re.MULTILINE)
+        self.assertEqual(900, self.index.search(pattern, 0))
+        self.assertEqual(901, self.index.search(pattern, 900))
+        self.assertEqual(998, self.index.search(pattern, 999, backwards=True))
+        self.assertIsNone(self.index.search(pattern, 900, backwards=True))
+        self.assertIsNone(self.index.search(pattern, 999))
+
+    def test_that_growing_file_is_followed(self):
+        with open(self.file_name, 'a') as log_file:
+            log_file.write("partial")
+        self.assertTrue(self.index.refresh())
+        self.index.index_some()
+        self.assertEqual(1001, self.index.get_line_count())
+        self.assertEqual(["partial"], self.index.get_lines(1000, 1))
+
+
+class LiveLogFileIndexTest(LogFileIndexTest):
+    live = True
+
+    def test_that_a_truncated_file_is_read_safely_and_reindexed(self):
+        with open(self.file_name, 'w') as log_file:  # As when a job is run again
+            log_file.write("rerun\n")
+        self.assertEqual(["", ""], self.index.get_lines(998, 2))  # Past the new end of the file, but no SIGBUS
+        self.assertIsNone(self.index.search(re.compile(rb"line"), 0))
+        self.assertTrue(self.index.refresh())
+        self.index.index_some()
+        self.assertEqual(1, self.index.get_line_count())
+        self.assertEqual(["rerun"], self.index.get_lines(0, 10))
+
+    def test_that_a_replaced_file_is_reopened(self):
+        with open(self.file_name + ".new", 'w') as log_file:
+            log_file.write("".join("new " + str(i) + "\n" for i in range(1000)))
+        os.replace(self.file_name + ".new", self.file_name)
+        self.assertTrue(self.index.refresh())
+        self.index.index_some()
+        self.assertEqual(["new 0"], self.index.get_lines(0, 1))
+
+
+class SelectionFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.filter = SelectionFilter(["uart_smoke", "uart_stress", "spi_smoke", "i2c_long"],
+                                      [{"smoke"}, set(), {"smoke"}, {"nightly"}],
+                                      [{"block": "uart"}, {"block": "uart", "seed": 3}, {"block": "spi"}, dict()])
+
+    def test_literal(self):
+        self.assertEqual({0, 2}, self.filter.get_selected("smoke"))
+
+    def test_prefix(self):
+        self.assertEqual({0, 1}, self.filter.get_selected("^uart"))
+        self.assertEqual(set(), self.filter.get_selected("^zzz"))
+
+    def test_regex(self):
+        self.assertEqual({1, 3}, self.filter.get_selected("(stress|long)$"))
+
+    def test_empty_selects_all(self):
+        self.assertEqual({0, 1, 2, 3}, self.filter.get_selected(""))
+
+    def test_tags_and_attributes(self):
+        self.assertEqual({0, 2}, self.filter.get_selected("tag:smoke"))
+        self.assertEqual({0}, self.filter.get_selected("tag:smoke attr:block=uart"))
+        self.assertEqual({1}, self.filter.get_selected("attr:seed"))
+        self.assertEqual({2}, self.filter.get_selected("tag:smoke ^spi"))
+
+    def test_invalid_regex(self):
+        with self.assertRaises(re.error):
+            self.filter.get_selected("(")
+
+    def test_that_results_are_cached(self):
+        self.assertIs(self.filter.get_selected("u.rt"), self.filter.get_selected("u.rt"))
+
+
+class DurationHistoryTest(unittest.TestCase):
+    def test_that_history_is_averaged_and_persisted(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            history = DurationHistory(temp_dir + "/history.json")
+            history.record("a", 10.0)
+            history.record("a", 20.0)
+            history.save()
+            self.assertEqual(15.0, DurationHistory(temp_dir + "/history.json").get("a"))
+            self.assertIsNone(DurationHistory(temp_dir + "/history.json").get("b"))
+
+    def test_that_a_sharded_run_does_not_update_the_history(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_name = temp_dir + "/history.json"
+            history = DurationHistory(file_name)
+            history.record("job0", 10.0)
+            history.save()
+            app = GatedTestApp(["-c", "--shard", "1/2", "--duration-history", file_name])  # The shard with job0
+            with contextlib.redirect_stdout(io.StringIO()), self.assertRaises(SystemExit):
+                app.run_selected_runners()
+            self.assertEqual({"job0": 10.0}, DurationHistory(file_name).get_all())
+
+
+class EtaEstimatorTest(unittest.TestCase):
+    def setUp(self):
+        self.runners = [DummyRunner("running"), DummyRunner("waiting")]
+        self.history = DurationHistory()
+        self.estimator = EtaEstimator(self.history)
+
+    def test_that_progress_is_extrapolated(self):
+        self.runners[0].running = True
+        self.runners[0].start_time = 100.0
+        self.runners[0].report_progress(0.25)
+        self.history.record("waiting", 5.0)
+        self.assertAlmostEqual(30.0, self.estimator.estimate_remaining(self.runners, now=110.0))
+        self.assertAlmostEqual(35.0, self.estimator.estimate_remaining(self.runners, parallelism=1, now=110.0))
+
+    def test_that_history_is_the_fallback(self):
+        self.assertIsNone(self.estimator.estimate_remaining(self.runners))
+        self.history.record("running", 7.0)
+        self.history.record("waiting", 3.0)
+        self.assertAlmostEqual(7.0, self.estimator.estimate_remaining(self.runners))
+
+    def test_that_the_cli_estimates_with_its_job_limit(self):
+        runners = [DummyRunner("r" + str(i)) for i in range(0, 4)]
+        for r in runners:
+            self.history.record(r.name, 10.0)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.assertAlmostEqual(10.0, Cli(runners, temp_dir, duration_history=self.history).estimate_remaining())
+            cli = Cli(runners, temp_dir, duration_history=self.history, scheduler=PriorityScheduler(max_workers=2))
+            self.assertAlmostEqual(20.0, cli.estimate_remaining())
+            for r in runners[1:]:
+                r.set_lightweight()
+            cli = Cli(runners, temp_dir, duration_history=self.history, batch_dispatcher=BatchDispatcher(1))
+            self.assertAlmostEqual(30.0, cli.estimate_remaining())
+
+    def test_format(self):
+        self.assertEqual("1:01:05", EtaEstimator.format_duration(3665))
+        self.assertEqual("unknown", EtaEstimator.format_duration(None))
+
+
+class RunnerSharderTest(unittest.TestCase):
+    def setUp(self):
+        self.runners = [DummyRunner("r" + str(i)) for i in range(0, 8)]
+        self.history = DurationHistory()
+
+    def get_shards(self, count):
+        return [[r.name for r in RunnerSharder.shard(self.runners, i, count, self.history)] for i in range(0, count)]
+
+    def test_that_every_runner_is_in_exactly_one_shard(self):
+        shards = self.get_shards(3)
+        self.assertEqual(sorted(r.name for r in self.runners), sorted(sum(shards, [])))
+        self.assertEqual(shards, self.get_shards(3))
+
+    def test_that_shards_are_balanced_by_duration(self):
+        for r, duration in zip(self.runners, [8, 1, 1, 1, 1, 1, 1, 2]):
+            self.history.record(r.name, duration)
+        self.assertEqual([["r0"], ["r1", "r2", "r3", "r4", "r5", "r6", "r7"]], self.get_shards(2))
+
+    def test_that_gating_groups_stay_together(self):
+        for r in self.runners[1:]:
+            r.set_start_gating_event(self.runners[0].stop_event)
+        shards = self.get_shards(4)
+        self.assertEqual([8], [len(shard) for shard in shards if len(shard) > 0])
+
+    def test_parse_shard_option(self):
+        self.assertEqual((1, 4), RunnerSharder.parse_shard_option("1/4"))
+        for text in ["4/4", "1", "-1/2", "a/b"]:
+            with self.assertRaises(ValueError):
+                RunnerSharder.parse_shard_option(text)
+
+
+class ConcurrencyProbeRunner(BaseJobRunner):
+    """Records the peak number of jobs of its probe group that run at the same time"""
+
+    def __init__(self, name, probe):
+        super().__init__(name)
+        self.probe = probe
+
+    def job(self):
+        with self.probe['lock']:
+            self.probe['running'] += 1
+            self.probe['peak'] = max(self.probe['peak'], self.probe['running'])
+        sleep(0.02)
+        with self.probe['lock']:
+            self.probe['running'] -= 1
+        return 0, "Output from " + self.name
+
+
+class BatchDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.job_mocking_event = threading.Event()
+        self.job_mocking_event.set()
+        self.runners = [DummyRunner("r" + str(i)) for i in range(0, 50)]
+        self.stopped = list()
+        for i, r in enumerate(self.runners):
+            r.set_lightweight()
+            r.set_result(i % 2)
+            r.set_args(job_mocking_event=self.job_mocking_event)
+            r.set_stop_callback(lambda name, result, output: self.stopped.append(name))
+
+    def test_that_each_runner_gets_its_own_result_and_callbacks(self):
+        dispatcher = BatchDispatcher(num_workers=3)
+        dispatcher.submit(self.runners)
+        dispatcher.start()
+        dispatcher.join()
+        self.assertEqual(sorted(r.name for r in self.runners), sorted(self.stopped))
+        for i, r in enumerate(self.runners):
+            self.assertTrue(r.stop_event.is_set())
+            self.assertEqual(JobStatus.FAILED if i % 2 else JobStatus.PASSED, r.status)
+            self.assertEqual("Output from r" + str(i), r.output)
+
+    def test_that_batched_and_scheduled_runners_share_the_job_limit(self):
+        probe = {'lock': threading.Lock(), 'running': 0, 'peak': 0}
+        runners = [ConcurrencyProbeRunner("r" + str(i), probe) for i in range(0, 12)]
+        for r in runners[::2]:
+            r.set_lightweight()
+        scheduler = PriorityScheduler(max_workers=2)
+        with tempfile.TemporaryDirectory() as temp_dir, contextlib.redirect_stdout(io.StringIO()):
+            cli = Cli(runners, temp_dir, batch_dispatcher=BatchDispatcher(2, scheduler=scheduler), scheduler=scheduler)
+            with self.assertRaises(SystemExit):
+                cli.run()
+        self.assertTrue(all(r.status == JobStatus.PASSED for r in runners))
+        self.assertLessEqual(probe['peak'], 2)
+
+    def test_that_batch_size_adapts_to_durations(self):
+        dispatcher = BatchDispatcher(num_workers=1)
+        dispatcher.submit(self.runners)
+        self.assertEqual(1, len(dispatcher.take_batch()))
+        dispatcher.observe_duration(0.05)
+        self.assertEqual(10, len(dispatcher.take_batch()))
+
+    def test_that_gated_runners_are_not_batched(self):
+        self.assertTrue(BatchDispatcher.can_batch(self.runners[0]))
+        self.runners[0].set_start_gating_event(threading.Event())
+        self.assertFalse(BatchDispatcher.can_batch(self.runners[0]))
+        self.assertFalse(BatchDispatcher.can_batch(DummyRunner("not lightweight")))
+
+
+class OutputClassifierTest(unittest.TestCase):
+    def setUp(self):
+        self.classifier = OutputClassifier(terminate_on_fatal=True)
+        self.classifier.add_pattern(Severity.FATAL, r"UVM_FATAL|Segmentation fault")
+        self.classifier.add_pattern(Severity.ERROR, r"UVM_ERROR")
+        self.classifier.add_pattern(Severity.WARNING, r"UVM_WARNING")
+        self.job_mocking_event = threading.Event()
+        self.runner = DummyRunner("classified")
+        self.runner.set_args(job_mocking_event=self.job_mocking_event)
+        self.runner.set_output_classifier(self.classifier)
+
+    def test_that_lines_split_across_chunks_are_counted_once(self):
+        scan = self.classifier.new_scan()
+        self.assertFalse(scan.feed("ok\nUVM_WARN"))
+        self.assertFalse(scan.feed("ING a\nUVM_ERROR b UVM_WARNING c\n"))
+        self.assertFalse(scan.feed("UVM_FAT"))
+        self.assertTrue(scan.feed("AL d\n"))
+        scan.finish()
+        self.assertEqual({Severity.FATAL: 1, Severity.ERROR: 1, Severity.WARNING: 1}, scan.counts)
+        self.assertEqual("1 fatal, 1 errors, 1 warnings: 'UVM_WARNING a', 'UVM_ERROR b UVM_WARNING c', "
+                         "'UVM_FATAL d'", scan.get_summary())
+
+    def test_that_patterns_that_cannot_be_combined_are_rejected(self):
+        for regex in [r"(?i)error", r"(a)\1", r"(?P<n>a)(?P=n)"]:
+            with self.assertRaises(re.error):
+                self.classifier.add_pattern(Severity.ERROR, regex)
+        self.classifier.add_pattern(Severity.ERROR, r"(?P<n>q)")
+        with self.assertRaises(re.error):
+            self.classifier.add_pattern(Severity.ERROR, r"(?P<n>b)")
+        self.classifier.add_pattern(Severity.ERROR, r"(?i:error)")
+        self.assertEqual(5, len(self.classifier.patterns))
+        self.assertIsNotNone(self.classifier.get_combined_pattern().search("ERROR"))
+        self.assertIsNone(self.classifier.get_combined_pattern().search("uvm_fatal"))
+
+    def test_that_a_match_overrides_a_passing_result(self):
+        self.runner.set_result(0)
+        self.runner.job = lambda: (0, "UVM_ERROR oops")
+        self.runner.run()
+        self.assertEqual(JobStatus.FAILED, self.runner.status)
+        self.assertEqual("FAIL (1) [0 fatal, 1 errors, 0 warnings: 'UVM_ERROR oops']", self.runner.result_message)
+        self.assertEqual(self.runner.result_message, JobResult.from_runner(self.runner).get_result_message())
+
+    def test_that_fatal_output_terminates_the_job(self):
+        self.runner.set_result(0)
+        job = self.runner.job
+
+        def streaming_job():
+            self.runner.emit_output("Segmentation fault\n")
+            return job()
+
+        self.runner.job = streaming_job
+        self.runner.run()  # DummyRunner.job() would wait forever if not terminated
+        self.assertTrue(self.runner.terminated_by_classifier)
+        self.assertEqual("FAIL (1) [1 fatal, 0 errors, 0 warnings: 'Segmentation fault']", self.runner.result_message)
+
+    def test_that_clean_output_passes(self):
+        self.runner.set_result(0)
+        self.job_mocking_event.set()
+        self.runner.run()
+        self.assertEqual("Success", self.runner.result_message)
+
+
+class RunJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.journal_file_name = self.temp_dir.name + "/journal.jsonl"
+        self.job_mocking_event = threading.Event()
+        self.job_mocking_event.set()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_that_finished_jobs_are_loaded(self):
+        journal = RunJournal(self.journal_file_name)
+        journal.record_start("a")
+        journal.record_start("b")
+        journal.record_finish(JobResult("a", JobStatus.FAILED, 2, 1.0, 2.0, "/tmp/a.txt", "1 errors"))
+        journal.close()
+        with open(self.journal_file_name, 'a') as journal_file:
+            journal_file.write('{"event": "finish", "name": "b", "sta')  # Interrupted mid-write
+        results = RunJournal.load_results(self.journal_file_name)
+        self.assertEqual(["a"], [r.name for r in results])
+        self.assertEqual(JobStatus.FAILED, results[0].status)
+        self.assertEqual("FAIL (2) [1 errors]", results[0].get_result_message())
+        self.assertEqual("/tmp/a.txt", results[0].output_file)
+
+    def run_cli(self, runners, resumed_results=None):
+        journal = RunJournal(self.journal_file_name)
+        cli = Cli(runners, self.temp_dir.name, journal=journal, resumed_results=resumed_results)
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(SystemExit) as context:
+                cli.run()
+        return cli, context.exception.code
+
+    def test_that_resume_only_runs_unfinished_jobs(self):
+        first = DummyRunner("first")
+        first.set_result(1)
+        first.set_args(job_mocking_event=self.job_mocking_event)
+        self.run_cli([first])
+
+        runners = [DummyRunner("first"), DummyRunner("second")]
+        for r in runners:
+            r.set_result(0)
+            r.set_args(job_mocking_event=self.job_mocking_event)
+        cli, exit_code = self.run_cli(runners, RunJournal.load_results(self.journal_file_name))
+        self.assertFalse(runners[0].job_ran)
+        self.assertTrue(runners[1].job_ran)
+        self.assertEqual(1, exit_code)  # The failure from before the interruption still counts
+        self.assertEqual(["first", "second"], [r.name for r in cli.result_store])
+        self.assertEqual("Output from first", cli.result_store.get("first").read_output())
+
+    def test_that_resumed_jobs_are_not_counted_as_queued(self):
+        first = DummyRunner("first")
+        first.set_result(0)
+        first.set_args(job_mocking_event=self.job_mocking_event)
+        self.run_cli([first])
+
+        metrics = RunMetrics()
+        runners = [DummyRunner("first"), DummyRunner("second")]
+        for r in runners:
+            r.set_result(0)
+            r.set_args(job_mocking_event=self.job_mocking_event)
+            r.add_observer(metrics)
+        self.run_cli(runners, RunJournal.load_results(self.journal_file_name))
+        self.assertFalse(runners[0].job_ran)
+        self.assertIn("ppr_jobs_queued 0\n", metrics.render())
+        self.assertIn("ppr_jobs_running 0\n", metrics.render())
+
+    def test_that_jobs_gated_on_a_resumed_job_still_start(self):
+        first = DummyRunner("first")
+        first.set_result(0)
+        first.set_args(job_mocking_event=self.job_mocking_event)
+        self.run_cli([first])
+
+        runners = [DummyRunner("first"), DummyRunner("second")]
+        for r in runners:
+            r.set_result(0)
+            r.set_args(job_mocking_event=self.job_mocking_event)
+        runners[1].set_start_gating_event(runners[0].stop_event)
+        results = RunJournal.load_results(self.journal_file_name)
+        thread = threading.Thread(target=self.run_cli, args=(runners, results), daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(runners[0].job_ran)
+        self.assertTrue(runners[1].job_ran)
+        self.assertEqual(JobStatus.PASSED, runners[0].status)
+
+
+class RunMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = RunMetrics()
+        self.gate = threading.Event()
+        self.job_mocking_event = threading.Event()
+        self.runners = [DummyRunner("r" + str(i)) for i in range(0, 3)]
+        for i, r in enumerate(self.runners):
+            r.add_observer(self.metrics)
+            r.set_result(i % 2)
+            r.set_args(job_mocking_event=self.job_mocking_event)
+        self.runners[2].set_start_gating_event(self.gate)
+
+    def test_that_metrics_follow_the_run(self):
+        for r in self.runners:
+            r.start()
+        sleep(0.05)  # Let threads have a chance to go
+        self.assertEqual(1, len(self.metrics.queued))
+        self.assertEqual(2, len(self.metrics.running))
+        self.job_mocking_event.set()
+        self.gate.set()
+        for r in self.runners:
+            r.stop_event.wait()
+            r.thread.join()
+        self.assertEqual((0, 0, 2, 1), (len(self.metrics.queued), len(self.metrics.running), self.metrics.passed,
+                                        self.metrics.failed))
+        self.assertEqual(3, self.metrics.get_jobs_per_minute())
+        text = self.metrics.render()
+        self.assertIn("ppr_jobs_failed_total 1\n", text)
+        self.assertIn('ppr_gate_wait_seconds_bucket{le="+Inf"} 3\n', text)
+
+    def test_http_and_snapshot_export(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            exporter = MetricsExporter(self.metrics, 0, temp_dir + "/metrics.prom")
+            exporter.start()
+            try:
+                with urllib.request.urlopen("http://127.0.0.1:" + str(exporter.port) + "/metrics") as response:
+                    self.assertIn("ppr_jobs_running 0", response.read().decode('utf-8'))
+            finally:
+                exporter.stop()
+            with open(temp_dir + "/metrics.prom") as snapshot_file:
+                self.assertEqual(self.metrics.render(), snapshot_file.read())
+
+
+class TraceWriterTest(unittest.TestCase):
+    def test_that_the_trace_is_valid_json_with_lanes(self):
+        job_mocking_event = threading.Event()
+        job_mocking_event.set()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_writer = TraceWriter(temp_dir + "/trace.json")
+            runners = [DummyRunner("r" + str(i)) for i in range(0, 3)]
+            for r in runners:
+                r.add_observer(trace_writer)
+                r.set_args(job_mocking_event=job_mocking_event)
+            runners[1].set_start_gating_event(runners[0].stop_event)
+            for r in runners:
+                r.start()
+            for r in runners:
+                r.thread.join()
+            trace_writer.close()
+            with open(temp_dir + "/trace.json") as trace_file:
+                events = json.load(trace_file)
+        running_spans = [e for e in events if e['ph'] == 'X' and e['cat'] == 'running']
+        self.assertEqual(["r0", "r1", "r2"], sorted(e['name'] for e in running_spans))
+        self.assertTrue(all(e['tid'] < 3 for e in running_spans))
+        self.assertEqual(1, len([e for e in events if e['ph'] == 'b' and e['cat'] == 'gated']))
+        self.assertEqual(0, [e for e in events if e['ph'] == 'C'][-1]['args']['running'])
+
+    def test_that_runners_finishing_after_close_are_dropped(self):
+        job_mocking_event = threading.Event()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_writer = TraceWriter(temp_dir + "/trace.json")
+            runner = DummyRunner("late")
+            runner.add_observer(trace_writer)
+            runner.set_args(job_mocking_event=job_mocking_event)
+            runner.start()
+            trace_writer.close()
+            job_mocking_event.set()
+            runner.thread.join()
+            self.assertEqual(JobStatus.FAILED, runner.status)  # Not an exception from writing to the closed file
+            with open(temp_dir + "/trace.json") as trace_file:
+                events = json.load(trace_file)
+        self.assertEqual([], [e for e in events if e['ph'] == 'X'])
+
+    def test_that_observers_see_a_runner_finish_before_its_stop_event_is_set(self):
+        job_mocking_event = threading.Event()
+        job_mocking_event.set()
+        stop_event_set_when_finished = list()
+
+        class Observer(RunObserver):
+            def runner_finished(self, runner):
+                stop_event_set_when_finished.append(runner.stop_event.is_set())
+
+        runner = DummyRunner("r0")
+        runner.add_observer(Observer())
+        runner.set_args(job_mocking_event=job_mocking_event)
+        runner.start()
+        self.assertTrue(runner.stop_event.wait(5))
+        self.assertEqual([False], stop_event_set_when_finished)
+
+
+class RunGroupTest(unittest.TestCase):
+    def setUp(self):
+        self.events = [threading.Event() for i in range(0, 3)]
+        self.runners = [DummyRunner("r" + str(i)) for i in range(0, 3)]
+        for r, event in zip(self.runners, self.events):
+            r.set_args(job_mocking_event=event)
+        self.group = RunGroup(self.runners)
+
+    def tearDown(self):
+        for event in self.events:
+            event.set()
+        self.group.close()
+
+    def test_as_completed_yields_in_completion_order(self):
+        self.group.start()
+        completed = self.group.as_completed(timeout=5)
+        self.events[2].set()
+        self.assertEqual("r2", next(completed).name)
+        self.events[0].set()
+        self.assertEqual("r0", next(completed).name)
+        self.events[1].set()
+        self.assertEqual(["r1"], [r.name for r in completed])
+
+    def test_as_completed_timeout(self):
+        self.group.start()
+        with self.assertRaises(TimeoutError):
+            list(self.group.as_completed(timeout=0.05))
+
+    def test_wait_any_and_wait_all(self):
+        self.group.start()
+        self.assertEqual(([], self.runners), self.group.wait_any(0.01))
+        self.events[1].set()
+        finished, pending = self.group.wait_any(5)
+        self.assertEqual(["r1"], [r.name for r in finished])
+        self.assertEqual(["r0", "r2"], [r.name for r in pending])
+        self.assertFalse(self.group.wait_all(0.01))
+        self.events[0].set()
+        self.events[2].set()
+        self.assertTrue(self.group.wait_all(5))
+
+    def test_that_a_rerun_is_waited_for_again(self):
+        for event in self.events:
+            event.set()
+        self.group.start()
+        self.assertTrue(self.group.wait_all(5))
+        for r in self.runners:
+            r.thread.join()
+        self.events[0].clear()
+        self.runners[0].start()
+        self.assertFalse(self.group.wait_all(0.01))
+        self.events[0].set()
+        self.assertTrue(self.group.wait_all(5))
+
+    def test_that_as_completed_yields_each_runner_once_across_reruns(self):
+        group = RunGroup(self.runners[:2])
+        group.start()
+        completed = group.as_completed(timeout=5)
+        self.events[0].set()
+        self.assertEqual("r0", next(completed).name)
+        self.runners[0].thread.join()
+        self.events[0].clear()
+        self.runners[0].start()
+        self.events[1].set()
+        self.assertTrue(self.runners[1].stop_event.wait(5))
+        self.events[0].set()
+        self.assertEqual(["r1"], [r.name for r in completed])
+        group.close()
+
+
+class PrioritySchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.job_mocking_event = threading.Event()
+        self.started = list()
+        self.runners = [DummyRunner("r" + str(i)) for i in range(0, 4)]
+        for r in self.runners:
+            r.set_args(job_mocking_event=self.job_mocking_event)
+            r.set_start_callback(self.started.append)
+        self.scheduler = PriorityScheduler(max_workers=1)
+
+    def tearDown(self):
+        self.job_mocking_event.set()
+        self.scheduler.start()
+        for r in self.runners:
+            if self.scheduler in r.observers:
+                r.stop_event.wait(5)
+        self.scheduler.stop()
+
+    def test_that_higher_priority_starts_first(self):
+        for r, priority in zip(self.runners, [0, 5, 1, 3]):
+            r.set_priority(priority)
+        group = RunGroup(self.runners)
+        self.scheduler.submit(self.runners)
+        self.scheduler.start()
+        self.job_mocking_event.set()
+        self.assertTrue(group.wait_all(5))
+        group.close()
+        self.assertEqual(["r1", "r3", "r2", "r0"], self.started)
+
+    def test_that_queued_runners_can_be_reprioritized(self):
+        self.scheduler.submit(self.runners)
+        self.scheduler.start()
+        sleep(0.05)  # Let r0 start and occupy the only slot
+        self.assertEqual(["r0"], self.started)
+        self.assertEqual(["r1", "r2", "r3"], [r.name for r in self.scheduler.get_queued_runners()])
+        self.scheduler.run_next(self.runners[3])
+        self.scheduler.reprioritize(self.runners[1], -1)
+        self.assertEqual(["r3", "r2", "r1"], [r.name for r in self.scheduler.get_queued_runners()])
+        self.assertFalse(self.scheduler.is_queued(self.runners[0]))
+
+    def test_that_waiting_runners_age(self):
+        self.runners[1].set_priority(1)
+        self.scheduler.submit(self.runners[:2])
+        self.scheduler.enqueue_times[id(self.runners[0])] -= 2.0 / PriorityScheduler.AGING_RATE
+        self.scheduler.reprioritize(self.runners[0], 0)
+        self.assertEqual(["r0", "r1"], [r.name for r in self.scheduler.get_queued_runners()])
+
+    def test_that_gated_runners_do_not_take_a_slot(self):
+        gate = threading.Event()
+        self.runners[0].set_start_gating_event(gate)
+        self.scheduler.submit(self.runners[:2])
+        self.scheduler.start()
+        sleep(0.05)  # Let the scheduler go
+        self.assertEqual(["r1"], self.started)
+        self.assertEqual(0, self.runners[1].worker_slot)
+        self.job_mocking_event.set()
+        gate.set()
+        self.runners[1].stop_event.wait(5)
+        self.runners[0].stop_event.wait(5)
+        self.assertEqual(["r1", "r0"], self.started)
+
+    def test_that_gated_runners_are_parked_until_their_gate_opens(self):
+        for r in self.runners[1:]:
+            r.set_start_gating_event(self.runners[0].stop_event)
+        self.scheduler = PriorityScheduler(max_workers=2)
+        self.scheduler.submit(self.runners)
+        self.scheduler.start()
+        sleep(0.05)  # Let r0 start
+        self.assertEqual(["r0"], self.started)
+        self.assertEqual([], self.scheduler.heap)
+        self.assertEqual(["r1", "r2", "r3"], [r.name for r in self.scheduler.get_queued_runners()])
+        self.job_mocking_event.set()
+        for r in self.runners:
+            self.assertTrue(r.stop_event.wait(5))
+        self.assertEqual({"r0", "r1", "r2", "r3"}, set(self.started))
+
+    def test_that_cleared_runners_never_start(self):
+        self.scheduler.submit(self.runners)
+        self.scheduler.start()
+        sleep(0.05)  # Let r0 start and occupy the only slot
+        self.scheduler.stop()
+        self.scheduler.clear()
+        self.assertEqual([], self.scheduler.get_queued_runners())
+        self.job_mocking_event.set()
+        self.runners[0].stop_event.wait(5)
+        self.scheduler.start()
+        sleep(0.05)
+        self.assertEqual(["r0"], self.started)
+        for r in self.runners[1:]:
+            r.remove_observer(self.scheduler)  # So that tearDown doesn't wait for them
+
+    def test_that_runners_can_be_rerun_by_another_scheduler(self):
+        self.job_mocking_event.set()
+        first_scheduler = PriorityScheduler(max_workers=1)
+        for scheduler in [first_scheduler, self.scheduler]:
+            group = RunGroup(self.runners)
+            scheduler.submit(self.runners)
+            scheduler.start()
+            self.assertTrue(group.wait_all(5))
+            group.close()
+        first_scheduler.stop()
+        self.assertEqual(["r0", "r1", "r2", "r3"] * 2, self.started)
+
+    def test_that_placement_binds_runners_to_free_cpus(self):
+        cpu = min(os.sched_getaffinity(0))
+        affinities = dict()
+
+        class AffinityRunner(DummyRunner):
+            def job(self):
+                affinities[self.name] = os.sched_getaffinity(0)
+                return super().job()
+
+        runners = [AffinityRunner("a" + str(i)) for i in range(0, 2)]
+        for r in runners:
+            r.set_args(job_mocking_event=self.job_mocking_event)
+            r.set_start_callback(self.started.append)
+        self.runners += runners
+        self.scheduler = PriorityScheduler(placement=CpuPlacement(NumaTopology({0: [cpu]})))
+        self.scheduler.submit(runners)
+        self.scheduler.start()
+        sleep(0.05)  # Let a0 start on the only CPU
+        self.assertEqual(["a0"], self.started)
+        self.assertEqual([cpu], runners[0].cpu_set)
+        self.job_mocking_event.set()
+        runners[1].stop_event.wait(5)
+        self.assertEqual(["a0", "a1"], self.started)
+        self.assertEqual({"a0": {cpu}, "a1": {cpu}}, affinities)
+
+    def test_that_placement_without_bind_only_limits_concurrency(self):
+        self.scheduler = PriorityScheduler(placement=CpuPlacement(NumaTopology({0: [0]}), bind=False))
+        self.scheduler.submit(self.runners[:2])
+        self.scheduler.start()
+        sleep(0.05)  # Let r0 start on the only CPU
+        self.assertEqual(["r0"], self.started)
+        self.assertIsNone(self.runners[0].cpu_set)
+        self.job_mocking_event.set()
+        self.assertTrue(self.runners[1].stop_event.wait(5))
+        self.assertEqual(["r0", "r1"], self.started)
+        self.assertEqual([0], self.scheduler.placement.free[0])
+
+
+class NumaTopologyTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        for node, cpu_list in [(0, "0-3,8\n"), (1, "4-7,9-10\n"), (2, "\n")]:
+            os.makedirs(os.path.join(self.temp_dir.name, "node" + str(node)))
+            with open(os.path.join(self.temp_dir.name, "node" + str(node), "cpulist"), "w") as f:
+                f.write(cpu_list)
+        os.makedirs(os.path.join(self.temp_dir.name, "power"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_parse_cpu_list(self):
+        self.assertEqual([0, 1, 2, 3, 8, 10, 11], NumaTopology.parse_cpu_list("0-3,8,10-11\n"))
+        self.assertEqual([], NumaTopology.parse_cpu_list("\n"))
+
+    def test_that_nodes_are_read_and_limited_to_the_allowed_cpus(self):
+        topology = NumaTopology.read(self.temp_dir.name, allowed_cpus=range(0, 10))
+        self.assertEqual({0: [0, 1, 2, 3, 8], 1: [4, 5, 6, 7, 9]}, dict(topology.nodes))
+        self.assertEqual(10, topology.get_num_cpus())
+
+    def test_that_without_node_information_all_allowed_cpus_are_on_node_0(self):
+        topology = NumaTopology.read(os.path.join(self.temp_dir.name, "missing"), allowed_cpus=[2, 0, 1])
+        self.assertEqual({0: [0, 1, 2]}, dict(topology.nodes))
+
+
+class CpuPlacementTest(unittest.TestCase):
+    def setUp(self):
+        self.placement = CpuPlacement(NumaTopology(OrderedDict([(0, [0, 1, 2, 3]), (1, [4, 5, 6, 7])])))
+
+    def test_that_a_runner_is_packed_onto_the_fullest_node_that_fits(self):
+        self.assertEqual([0, 1, 2], self.placement.allocate(3))
+        self.assertEqual([3], self.placement.allocate(1))
+        self.assertEqual([4, 5], self.placement.allocate(2))
+        self.assertIsNone(self.placement.allocate(3))  # 2 CPUs are free, on node 1
+        self.placement.release([0, 1, 2])
+        self.assertEqual([0, 1, 2], self.placement.allocate(3))
+
+    def test_that_a_request_larger_than_a_node_is_spread_over_nodes(self):
+        self.assertEqual([0, 1, 2], self.placement.allocate(3))
+        self.assertIsNone(self.placement.allocate(6))
+        self.placement.release([0, 1, 2])
+        self.assertEqual([0, 1, 2, 3, 4, 5], self.placement.allocate(6))
+        self.placement.release([0, 1, 2, 3, 4, 5])
+        self.assertEqual(list(range(0, 8)), self.placement.allocate(100))
+
+
+class BackgroundDeleterTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.deleter = BackgroundDeleter()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_that_a_path_is_gone_immediately_and_deleted_in_the_background(self):
+        tree = os.path.join(self.temp_dir.name, "tree")
+        os.makedirs(os.path.join(tree, "a", "b"))
+        file_name = os.path.join(self.temp_dir.name, "file.txt")
+        with open(file_name, "w") as f:
+            f.write("output")
+        self.deleter.delete(tree)
+        self.deleter.delete(file_name)
+        self.assertFalse(os.path.exists(tree))
+        self.assertFalse(os.path.exists(file_name))
+        self.assertTrue(self.deleter.wait(5))
+        self.assertEqual([], os.listdir(self.temp_dir.name))
+
+    def test_that_a_missing_path_is_ignored(self):
+        self.deleter.delete(os.path.join(self.temp_dir.name, "missing"))
+        self.assertTrue(self.deleter.wait(5))
+
+
+class ScratchManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_runner(self, name, result):
+        r = DummyRunner(name)
+        r.set_result(result)
+        r.set_args(job_mocking_event=threading.Event())
+        r.setup_kwargs['job_mocking_event'].set()
+        return r
+
+    def test_that_each_job_gets_its_own_scratch_dir_which_is_removed_after(self):
+        scratch_manager = ScratchManager(self.temp_dir.name)
+        scratch_dirs = list()
+        runners = [self.create_runner("r/" + str(i), 0) for i in range(0, 2)]
+        for r in runners:
+            r.set_scratch_manager(scratch_manager)
+            r.start()
+        for r in runners:
+            r.stop_event.wait(5)
+            scratch_dirs.append(r.setup_kwargs['scratch_dir'])
+            self.assertIsNone(r.scratch_dir)
+        self.assertNotEqual(scratch_dirs[0], scratch_dirs[1])
+        for scratch_dir in scratch_dirs:
+            self.assertTrue(scratch_dir.startswith(self.temp_dir.name))
+            self.assertNotIn("/", os.path.basename(scratch_dir))
+            self.assertFalse(os.path.exists(scratch_dir))
+        scratch_manager.close()
+        self.assertTrue(scratch_manager.deleter.wait(5))
+        self.assertEqual([], os.listdir(self.temp_dir.name))
+
+    def test_that_failing_scratch_dirs_are_kept_if_requested(self):
+        scratch_manager = ScratchManager(self.temp_dir.name, keep_failed=True)
+        passing = scratch_manager.acquire("passing")
+        failing = scratch_manager.acquire("failing")
+        scratch_manager.release(passing, True)
+        scratch_manager.release(failing, False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            scratch_manager.close()
+        self.assertTrue(scratch_manager.deleter.wait(5))
+        self.assertFalse(os.path.exists(passing))
+        self.assertTrue(os.path.isdir(failing))
+        self.assertEqual([failing], scratch_manager.get_kept_dirs())
+
+    def test_that_a_location_without_enough_free_space_is_not_used(self):
+        scratch_manager = ScratchManager(self.temp_dir.name, min_free_bytes=2 ** 62)
+        with self.assertRaises(IOError):
+            scratch_manager.acquire("r0")
+        self.assertEqual([], os.listdir(self.temp_dir.name))
+
+
+class DaemonTestApp:
+    """Stands in for a ParallelProcRunnerAppBase served by a RunnerDaemon"""
+
+    class Options:
+        select = None
+
+    def __init__(self, watched_file):
+        self.options = DaemonTestApp.Options()
+        self.watched_file = watched_file
+        self.catalog = None
+
+    def get_runners(self):
+        return [DummyRunner("r" + str(i)) for i in range(0, 4)]
+
+    def get_watched_files(self):
+        return [self.watched_file]
+
+    def run_selected_runners(self):
+        names = [r.name for r in self.catalog if re.search(self.options.select, r.name)]
+        print("Running", " ".join(names))
+        sys.exit(len(names))
+
+
+class RunnerDaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.temp_dir.name, "daemon.sock")
+        self.watched_file = os.path.join(self.temp_dir.name, "tests.list")
+        with open(self.watched_file, "w") as f:
+            f.write("r0 r1 r2 r3\n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.daemon = RunnerDaemon(DaemonTestApp(self.watched_file), self.socket_path, num_workers=2,
+                                       poll_interval=0.02)
+            self.thread = threading.Thread(target=self.daemon.serve_forever)
+            self.thread.start()
+
+    def tearDown(self):
+        self.daemon.stop()
+        self.thread.join(5)
+        self.temp_dir.cleanup()
+
+    def test_that_clients_are_served_from_the_warm_catalog(self):
+        for select, expected_names in [("r[12]", ["r1", "r2"]), ("r3", ["r3"]), ("r[0-3]", ["r0", "r1", "r2", "r3"])]:
+            out = io.StringIO()
+            self.assertEqual(len(expected_names), DaemonClient(self.socket_path).run(select, out))
+            self.assertEqual("Running " + " ".join(expected_names) + "\n", out.getvalue())
+
+    def test_that_an_exception_in_a_run_is_reported_to_the_client(self):
+        out = io.StringIO()
+        self.assertEqual(1, DaemonClient(self.socket_path).run("(", out))
+        self.assertIn("error", out.getvalue())
+
+    def test_that_the_catalog_is_stale_when_a_watched_file_changes(self):
+        # Not served, since serving a stale catalog re-executes the process
+        daemon = RunnerDaemon(DaemonTestApp(self.watched_file), os.path.join(self.temp_dir.name, "other.sock"))
+        daemon.listener.close()
+        daemon.load_catalog()
+        self.assertEqual(["r0", "r1", "r2", "r3"], [r.name for r in daemon.app.catalog])
+        self.assertFalse(daemon.catalog_is_stale())
+        stat = os.stat(self.watched_file)
+        os.utime(self.watched_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertTrue(daemon.catalog_is_stale())
+
+    def test_that_output_is_dropped_once_the_client_has_gone_away(self):
+        connection, peer = socket.socketpair()
+        peer.close()
+        disconnects = list()
+        stream = DaemonOutputStream(connection, lambda: disconnects.append(True))
+        with connection:
+            for _ in range(0, 3):
+                self.assertEqual(5, stream.write("text\n"))
+        self.assertTrue(stream.disconnected)
+        self.assertEqual([True], disconnects)
+
+    def test_that_a_client_closing_the_connection_is_noticed_while_nothing_is_written(self):
+        connection, peer = socket.socketpair()
+        disconnects = list()
+        stream = DaemonOutputStream(connection, lambda: disconnects.append(True))
+        with connection:
+            peer.close()
+            stream.watch()
+        self.assertEqual([True], disconnects)
+
+    def test_that_stopping_removes_the_socket(self):
+        self.daemon.stop()
+        self.thread.join(5)
+        self.assertFalse(os.path.exists(self.socket_path))
+        with self.assertRaises(OSError):
+            DaemonClient(self.socket_path).run("r0")
+
+
+class GatedTestApp(ParallelProcRunnerAppBase):
+    """A real app with job1 to job3 gated on job0"""
+
+    class Runner(BaseJobRunner):
+        def job(self):
+            return 0, "Output from " + self.name
+
+    def __init__(self, argv):
+        with unittest.mock.patch.object(sys, 'argv', ["test"] + argv):
+            super().__init__("test")
+
+    def get_runners(self):
+        runners = [GatedTestApp.Runner("job" + str(i)) for i in range(0, 4)]
+        for r in runners[1:]:
+            r.set_start_gating_event(runners[0].stop_event)
+        return runners
+
+
+class ExitingTestApp(GatedTestApp):
+    """Returns from run_interface() while its failing jobs are still finishing, as the GUI does when it exits"""
+
+    class Runner(BaseJobRunner):
+        def job(self):
+            sleep(0.2)
+            return 1, "Output from " + self.name
+
+    def get_runners(self):
+        return [ExitingTestApp.Runner("job" + str(i)) for i in range(0, 2)]
+
+    def run_interface(self, runners, output_archive, duration_history):
+        for r in runners:
+            r.start()
+
+
+class AppSelectTest(unittest.TestCase):
+    def test_that_select_adds_the_runners_that_gate_the_selection(self):
+        app = GatedTestApp(["-c", "--select", "job[12]"])
+        self.assertEqual(["job0", "job1", "job2"], [r.name for r in app.get_selected_runners(DurationHistory())])
+
+    def test_that_batch_workers_are_limited_by_jobs(self):
+        self.assertEqual(2, GatedTestApp(["-c", "--batch", "-j", "2"]).options.batch_workers)
+        for argv in [["-c", "--batch", "-j", "2", "--batch-workers", "3"], ["-c", "--batch", "--cpu-placement"]]:
+            with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+                GatedTestApp(argv)
+
+    def test_that_scratch_space_outlives_the_jobs_still_finishing_on_exit(self):
+        with tempfile.TemporaryDirectory() as temp_dir, contextlib.redirect_stdout(io.StringIO()):
+            app = ExitingTestApp(["-c", "--scratch-dir", temp_dir, "--keep-failed-scratch"])
+            app.run_selected_runners()
+            run_dirs = [d for d in os.listdir(temp_dir) if d.startswith(ScratchManager.RUN_DIR_PREFIX)]
+            self.assertEqual(1, len(run_dirs))
+            kept_dirs = os.listdir(os.path.join(temp_dir, run_dirs[0]))
+            self.assertEqual(["job0", "job1"], sorted(d.split("-")[0] for d in kept_dirs))
+
+    def test_that_a_daemon_runs_a_selection_with_the_cli(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            socket_path = os.path.join(temp_dir, "daemon.sock")
+            with contextlib.redirect_stdout(io.StringIO()):
+                daemon = RunnerDaemon(GatedTestApp(["--daemon", socket_path]), socket_path, num_workers=1,
+                                      poll_interval=0.02)
+                thread = threading.Thread(target=daemon.serve_forever)
+                thread.start()
+            try:
+                out = io.StringIO()
+                self.assertEqual(0, DaemonClient(socket_path, timeout=10).run("job[12]", out))
+            finally:
+                daemon.stop()
+                thread.join(5)
+        for name in ["job0", "job1", "job2"]:
+            self.assertIn("# " + name + "\n", out.getvalue())  # Lines printed by the runner threads may interleave
+        self.assertNotIn("job3", out.getvalue())
+        self.assertIn("All tests passed", out.getvalue())
+
 
 if __name__ == '__main__':
     unittest.main()